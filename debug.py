@@ -6,17 +6,20 @@ This module defines debugging routines.
 import kaheap
 import kasystem as ka
 import kainit
+import kasim
 
 
 def select_reaction_basic(self):
     """
     Obsolete. Supplanted by the version with heaps. Kept for testing.
     """
+    # the activities by kind of channel are derived from the flat vector
+    ka.system.mixture.update_stratified_activities()
     # The first few choices relate to in/outflow of atoms.
     # Since there are only a few types, looping is OK.
-    rv = ka.system.sim.rng.uniform(low=0.0, high=ka.system.mixture.total_activity)
+    rv = ka.system.sim.uniform() * ka.system.mixture.total_activity
     if rv < ka.system.mixture.total_inflow:
-        select = 'inflow'
+        select = kasim.INFLOW
         for a in ka.system.mixture.activity_inflow:
             if rv < ka.system.mixture.activity_inflow[a]:
                 self.current_reaction = select, (a, None), (None, None), (None, None)
@@ -26,7 +29,7 @@ def select_reaction_basic(self):
 
     rv -= ka.system.mixture.total_inflow
     if rv < ka.system.mixture.total_outflow:
-        select = 'outflow'
+        select = kasim.OUTFLOW
         for a in ka.system.mixture.activity_outflow:
             if rv < ka.system.mixture.activity_outflow[a]:
                 self.current_reaction =  select, (a, None), (None, None), (None, None)
@@ -37,9 +40,9 @@ def select_reaction_basic(self):
     rv -= ka.system.mixture.total_outflow
     if rv < ka.system.mixture.unimolecular_binding_activity:
         # channel is a unimolecular binding event
-        select = 'ub'
+        select = kasim.UB
         for bt in ka.system.signature.bond_types:
-            if rv < ka.system.mixture.activity_unimolecular_binding[bt]:
+            if rv < ka.system.mixture.activity_unimolecular_binding[ka.system.mixture.bt_id[bt]]:
                 # the internal bond to be formed is of type bt
                 # refine search to the molecular level
                 for m in ka.system.mixture.complexes:
@@ -50,39 +53,39 @@ def select_reaction_basic(self):
                         # bt is (agent_type1.site1), (agent_type2.site2)
                         # NOTE: I don't think we need to randomize which site we choose first.
                         s1, s2 = bt
-                        r1 = ka.system.sim.rng.integers(low=0, high=m.free_site[s1])
+                        r1 = ka.system.sim.randint(m.free_site[s1])
                         # this is our choice of site1; it belongs to agent name1 in molecule m
                         name1, site1 = m.free_site_list[s1][r1]
                         if s1 == s2:
                             temp_list = [p for p in m.free_site_list[s2] if p != (name1, site1)]
-                            r2 = ka.system.sim.rng.integers(low=0, high=m.free_site[s2] - 1)
+                            r2 = ka.system.sim.randint(m.free_site[s2] - 1)
                             name2, site2 = temp_list[r2]
                         else:
                             # exclude possibility of self-binding
                             site2 = s2.split('.')[1]
                             if (name1, site2) in m.free_site_list[s2]:
                                 temp_list = [p for p in m.free_site_list[s2] if p != (name1, site2)]
-                                r2 = ka.system.sim.rng.integers(low=0, high=m.free_site[s2] - 1)
+                                r2 = ka.system.sim.randint(m.free_site[s2] - 1)
                                 name2, site2 = temp_list[r2]
                                 self.current_reaction =  select, (m, None), (name1, site1), (name2, site2)
                                 return
                             else:
-                                r2 = ka.system.sim.rng.integers(low=0, high=m.free_site[s2])
+                                r2 = ka.system.sim.randint(m.free_site[s2])
                                 name2, site2 = m.free_site_list[s2][r2]
                         self.current_reaction =  select, (m, None), (name1, site1), (name2, site2)
                         return
                     else:
                         rv -= segment
             else:
-                rv -= ka.system.mixture.activity_unimolecular_binding[bt]
+                rv -= ka.system.mixture.activity_unimolecular_binding[ka.system.mixture.bt_id[bt]]
 
     # Note to self: navigation across intervals may need to be changed to accommodate size-dependent alpha
     rv -= ka.system.mixture.unimolecular_binding_activity
     if rv < ka.system.mixture.bond_dissociation_activity:
         # channel is a bond dissociation
-        select = 'bd'
+        select = kasim.BD
         for bt in ka.system.signature.bond_types:
-            if rv < ka.system.mixture.activity_bond_dissociation[bt]:
+            if rv < ka.system.mixture.activity_bond_dissociation[ka.system.mixture.bt_id[bt]]:
                 # refine search to molecular level
                 for m in ka.system.mixture.complexes:
                     segment = m.unbinding[bt] * m.count
@@ -90,24 +93,24 @@ def select_reaction_basic(self):
                         # it's molecule of species m; now we need to uniformly choose the instance of bt in m
                         # bt is (agent_type_1.site_1), (agent_type_2.site_2)
                         # choose a bond of this type
-                        r = ka.system.sim.rng.integers(low=0, high=m.bond_type[bt])
+                        r = ka.system.sim.randint(m.bond_type[bt])
                         x, y = m.bond_list[bt][r]
                         self.current_reaction =  select, (m, None), x, y
                         return
                     else:
                         rv -= segment
             else:
-                rv -= ka.system.mixture.activity_bond_dissociation[bt]
+                rv -= ka.system.mixture.activity_bond_dissociation[ka.system.mixture.bt_id[bt]]
 
     rv -= ka.system.mixture.bond_dissociation_activity
     if rv < ka.system.mixture.bimolecular_binding_activity:
         # channel is a bimolecular binding
-        select = 'bb'
+        select = kasim.BB
         for bt in ka.system.signature.bond_types:
-            if rv < ka.system.mixture.activity_bimolecular_binding[bt]:
+            if rv < ka.system.mixture.activity_bimolecular_binding[ka.system.mixture.bt_id[bt]]:
                 s1, s2 = bt
                 # choose at random (uniformly) an s1, i.e. an agent and free site of required type
-                r1 = ka.system.sim.rng.integers(low=0, high=ka.system.mixture.total_free_sites[s1])
+                r1 = ka.system.sim.randint(ka.system.mixture.total_free_sites[s1])
                 for m1 in ka.system.mixture.complexes:
                     segment = m1.free_site[s1] * m1.count
                     if r1 < segment:
@@ -115,7 +118,7 @@ def select_reaction_basic(self):
                         break
                     else:
                         r1 -= segment
-                r2 = ka.system.sim.rng.integers(low=0, high=ka.system.mixture.total_free_sites[s2] - m1.free_site[s2])
+                r2 = ka.system.sim.randint(ka.system.mixture.total_free_sites[s2] - m1.free_site[s2])
                 m1.count -= 1  # only temporary!
                 for m2 in ka.system.mixture.complexes:
                     segment = m2.free_site[s2] * m2.count
@@ -125,14 +128,14 @@ def select_reaction_basic(self):
                     else:
                         r2 -= segment
                 m1.count += 1  # undo
-                r1 = ka.system.sim.rng.integers(low=0, high=m1.free_site[s1])
-                r2 = ka.system.sim.rng.integers(low=0, high=m2.free_site[s2])
+                r1 = ka.system.sim.randint(m1.free_site[s1])
+                r2 = ka.system.sim.randint(m2.free_site[s2])
                 name1, site1 = m1.free_site_list[s1][r1]
                 name2, site2 = m2.free_site_list[s2][r2]
                 self.current_reaction =  select, (m1, m2), (name1, site1), (name2, site2)
                 return
             else:
-                rv -= ka.system.mixture.activity_bimolecular_binding[bt]
+                rv -= ka.system.mixture.activity_bimolecular_binding[ka.system.mixture.bt_id[bt]]
 
 
 def test_heap():
@@ -154,7 +157,7 @@ def test_heap():
     sample = [0] * len(system.mixture.complexes)
     n_total = 0
     for i in range(0, 1000000):
-        rv = system.sim.rng.integers(low=0, high=system.mixture.total_free_sites[var])
+        rv = system.sim.randint(system.mixture.total_free_sites[var])
         idx = system.heap.draw_node(rv)
         sample[idx] += 1
         n_total += 1
@@ -0,0 +1,151 @@
+# Walter Fontana, 2023
+"""
+This module defines a composition-rejection index, an alternative to the heaps of kaheap for selecting
+molecular species in proportion to their weight.
+
+Species are grouped by the binary exponent of their weight: group k holds the weights in [2^(k-1), 2^k).
+A draw first picks a group in proportion to its weight sum (there are only a few groups), then picks a
+member of the group by rejection: a uniformly chosen member is accepted with probability weight / 2^k,
+which is at least 1/2. Draws and updates thus take O(1) expected time, regardless of the number of species.
+
+The index has the interface of kaheap.Heap; select it with '%par: selection = cr'.
+"""
+
+import math
+
+
+class CRIndex:
+    # as for kaheap.Heap
+    __slots__ = ('id', 'uniform', 'weight', 'group_of', 'position', 'members', 'group_sum', 'n_entries')
+
+    def __init__(self, data, ident=None, uniform=None):
+        self.id = ident
+        # source of uniform variates in [0, 1) for the rejection step (the simulator's buffered stream)
+        self.uniform = uniform
+        # per data item (indexed as mixture.complexes): weight, group and position within the group
+        self.weight = []
+        self.group_of = []
+        self.position = []
+        # per group: the data items it holds and the sum of their weights
+        self.members = {}
+        self.group_sum = {}
+        self.n_entries = 0
+
+        for data_item in data:
+            self.insert(data_item)
+
+    def _add(self, index, w):
+        # place data item 'index' with weight w into its group
+        self.weight[index] = w
+        if w > 0.:
+            k = math.frexp(w)[1]  # w is in [2^(k-1), 2^k)
+            members = self.members.setdefault(k, [])
+            self.group_of[index] = k
+            self.position[index] = len(members)
+            members.append(index)
+            self.group_sum[k] = self.group_sum.get(k, 0.) + w
+        else:
+            self.group_of[index] = None
+
+    def _remove(self, index):
+        # take data item 'index' out of its group in O(1) by moving the group's last member into its place
+        k = self.group_of[index]
+        if k is not None:
+            members = self.members[k]
+            last = members.pop()
+            if last != index:
+                p = self.position[index]
+                members[p] = last
+                self.position[last] = p
+            if members:
+                self.group_sum[k] -= self.weight[index]
+            else:  # an empty group also sheds any accumulated round-off
+                del self.members[k]
+                del self.group_sum[k]
+            self.group_of[index] = None
+        self.weight[index] = 0.
+
+    def insert(self, data_item):
+        # The new data item gets the next index, as the species appended to mixture.complexes.
+        self.weight.append(0.)
+        self.group_of.append(None)
+        self.position.append(0)
+        self.n_entries += 1
+        self._add(self.n_entries - 1, float(data_item))
+
+    def delete(self, index):
+        # As in Heap.delete(): the last data item moves into the place of the deleted one.
+        last = self.n_entries - 1
+        w_last = self.weight[last]
+        self._remove(index)
+        if index != last:
+            self._remove(last)
+            self._add(index, w_last)
+        self.weight.pop()
+        self.group_of.pop()
+        self.position.pop()
+        self.n_entries -= 1
+
+    def modify(self, data_item, index):
+        w = float(data_item)
+        k = self.group_of[index]
+        if k is not None and w > 0. and math.frexp(w)[1] == k:
+            # the item stays in its group
+            self.group_sum[k] += w - self.weight[index]
+            self.weight[index] = w
+        else:
+            self._remove(index)
+            self._add(index, w)
+
+    def modify_many(self, data_items, indices):
+        for data_item, index in zip(data_items, indices):
+            self.modify(data_item, index)
+
+    def _pick(self, k, exclude, weight):
+        # rejection sampling within group k, with 'weight' discounted from data item 'exclude'
+        members = self.members[k]
+        n = len(members)
+        bound = math.ldexp(1., k)
+        uniform = self.uniform
+        while True:
+            index = members[int(uniform() * n)]
+            w = self.weight[index]
+            if index == exclude:
+                w -= weight
+            if uniform() * bound < w:
+                return index
+
+    def draw_node(self, rv):
+        # 'rv' in [0, total weight) selects the group; the member is drawn with fresh variates.
+        chosen = None
+        for k, s in self.group_sum.items():
+            if rv < s:
+                return self._pick(k, None, 0.)
+            rv -= s
+            chosen = k
+        # round-off carried rv past the last group
+        return self._pick(chosen, None, 0.)
+
+    def draw_node_excluding(self, rv, index, weight):
+        # Draw as if 'weight' were removed from the data item at 'index', without modifying the index.
+        kx = self.group_of[index]
+        chosen = None
+        for k, s in self.group_sum.items():
+            if k == kx:
+                s -= weight
+            if s <= 0.:
+                continue
+            if rv < s:
+                return self._pick(k, index, weight)
+            rv -= s
+            chosen = k
+        return self._pick(chosen, index, weight)
+
+    def __str__(self):
+        """
+        Print index stats.
+        """
+        info = f"CR INDEX {self.id} -> entries|{self.n_entries} groups|{len(self.members)} "
+        info += f"total| {sum(self.group_sum.values()):1.2E}"
+        info += '\n'
+        return info
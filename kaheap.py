@@ -1,29 +1,65 @@
 # Walter Fontana, 2022
 """
 This module defines a 'heap' structure for more efficient reaction selection.
+
+The heap is a 4-ary sum tree: node i has children 4*i+1 ... 4*i+4 and holds their sum. Compared to
+a binary tree, this halves the height (and the cache lines touched per descent), since the 4 siblings
+of a group are contiguous and laid out to share a 64-byte cache line.
+
+The tree is stored in float32, which halves the memory traffic of descents and updates. The heaps only
+steer the selection within a channel; the channel activities themselves are kept in float64 by the mixture.
+Since every internal node is recomputed from its children, the tree does not accumulate round-off.
+float32 holds integers exactly only up to 2**24 (about 1.7e7): the st heaps, whose leaves and sums are
+free-site counts, select exactly only while the free-site total of a site type stays below that bound.
 """
 
 # This is an adaptation of an implementation provided by Rolf Fagerberg (SDU, Odense, Denmark).
 
-import math
+import numpy as np
+
+import kajit
+
+
+# storage type of the trees (see also the signatures of the ahead-of-time build in kajit.py)
+TREE_DTYPE = np.float32
+
+
+def aligned_zeros(n, dtype=TREE_DTYPE):
+    """
+    Returns an array of n zeros whose sibling groups (starting at index 1, in strides of 4) are aligned
+    to the size of a group, so that no group straddles a 64-byte cache line.
+    """
+    size = np.dtype(dtype).itemsize
+    base = np.zeros(n + 4, dtype=dtype)
+    offset = (-(base.ctypes.data + size) % (4 * size)) // size
+    return base[offset:offset + n]
 
 
 class Heap:
+    # A heap is touched by every reaction event; fixed slots make its attribute reads cheaper.
+    __slots__ = ('id', 'data', 'n_entries', 'height', 'n_leaves', 'n_internal_nodes', 'available', 'tree',
+                 'first_data_item', 'last_data_item')
+
     def __init__(self, data, ident=None):
         self.id = ident
-        self.data = data  # 'data' should not be modified outside the class!
+        # The initial data are copied (as float32) into the leaves of the tree; later changes go through
+        # insert(), delete() and modify(). The tree is a numpy array, which lets the compiled kernels
+        # in kajit operate on it directly.
+        self.data = np.array(data, dtype=TREE_DTYPE)
         # the number of data entries
         self.n_entries = len(self.data)
         # height of the tree (0, 1, ...) that accommodates at least n_entries (as leaves).
         if self.n_entries == 0:
             self.height = 0
         else:
-            self.height = int(math.log(self.n_entries, 2)) + 1
+            self.height = 1
+            while 4 ** self.height < self.n_entries:
+                self.height += 1
         # define the variables of the class; explained in make_tree()
         self.n_leaves = 0
         self.n_internal_nodes = 0
         self.available = 0
-        self.tree = []
+        self.tree = np.zeros(0, dtype=TREE_DTYPE)
         self.first_data_item = 0
         self.last_data_item = 0
 
@@ -34,56 +70,55 @@ class Heap:
         if self.height == 0:
             self.n_leaves = 0
         else:
-            self.n_leaves = 2 ** self.height
+            self.n_leaves = 4 ** self.height
         # the number of internal nodes in a full and complete tree of height h
-        self.n_internal_nodes = max(self.n_leaves - 1, 0)
+        self.n_internal_nodes = max((self.n_leaves - 1) // 3, 0)
         # n_entries of the leaves carry data. This, then, is the available space before we need to add another level.
         self.available = self.n_leaves - self.n_entries
-        # the data "structure". (All the "structure" is virtual by how we address the elements of the list.)
-        self.tree = [0] * self.n_internal_nodes + self.data + [0] * self.available
         # indices of first and last data items
         self.first_data_item = self.n_internal_nodes
         self.last_data_item = self.n_internal_nodes + self.n_entries - 1
+        # the data "structure". (All the "structure" is virtual by how we address the elements of the array.)
+        self.tree = aligned_zeros(self.n_internal_nodes + self.n_leaves)
+        self.tree[self.first_data_item:self.last_data_item + 1] = self.data
         # make the tree structure
         self.initialize_tree()
 
     def initialize_tree(self):
         # initialize the internal node values, by 'descending' from the parent of the last data item towards the root
-        i = (self.last_data_item - 1) // 2  # parent of the last data item
+        i = (self.last_data_item - 1) // 4  # parent of the last data item
         while i >= 0:
-            self.tree[i] = self.tree[2 * i + 1] + self.tree[2 * i + 2]  #self.update_node(i)
+            self.update_node(i)
             i = i - 1
 
     def update_node(self, i):
-        # the value at node i is the sum of the values of its left (2*i+1) and right (2*i+2) child.
-        self.tree[i] = self.tree[2 * i + 1] + self.tree[2 * i + 2]
+        # the value at node i is the sum of the values of its 4 children (4*i+1 ... 4*i+4).
+        c = 4 * i + 1
+        self.tree[i] = self.tree[c] + self.tree[c + 1] + self.tree[c + 2] + self.tree[c + 3]
 
     def update_from_leaf(self, i):
-        while i > 0:
-            i = (i - 1) // 2  # parent of i
-            self.tree[i] = self.tree[2 * i + 1] + self.tree[2 * i + 2]  # self.update_node(i)
+        kajit.update_from_leaf(self.tree, i)
 
     def add_layer(self):
-        # Note: Python is 'pass-by-object-reference', so self.data points to our original data content.
-        # If that content changes, as it does during simulation, it is reflected
-        # in self.data of our heap object. We don't need to pass any items.
+        # The data items are the leaves of the current tree; they are carried over into the larger tree.
+        # (self.data is then a view of the leaves of the old tree and only serves the copy below.)
 
         # update the shape values of the heap
         self.height += 1
-        self.n_leaves = 2 ** self.height
-        self.n_internal_nodes = self.n_leaves - 1
+        self.n_leaves = 4 ** self.height
+        self.n_internal_nodes = (self.n_leaves - 1) // 3
         self.available = self.n_leaves - self.n_entries
         # make a new heap
         self.data = self.tree[self.first_data_item:self.last_data_item + 1]
-        self.tree = [0] * self.n_internal_nodes + self.data + [0] * self.available
         self.first_data_item = self.n_internal_nodes
         self.last_data_item = self.n_internal_nodes + self.n_entries - 1
+        self.tree = aligned_zeros(self.n_internal_nodes + self.n_leaves)
+        self.tree[self.first_data_item:self.last_data_item + 1] = self.data
         self.initialize_tree()
 
     def insert(self, data_item):
-        # The function assumes that the last item has been appended to 'data'.
-        # Note: self.data points to the same contents as the data list of the caller,
-        # so we don't need to pass an item.
+        # data_item becomes the last leaf. (The tree holds its own float32 copy of the data;
+        # it does not track the caller's list.)
         if self.n_entries == self.n_leaves:  # level is full, add another level
             self.add_layer()
         self.n_entries = self.n_entries + 1
@@ -109,25 +144,24 @@ class Heap:
         # Call this _after_ modifying properties of a molecular species.
         i = index + self.first_data_item
         self.tree[i] = data_item
-        # the below is self.update_from_leaf(i)
-        while i > 0:
-            i = (i - 1) // 2  # parent of i
-            self.tree[i] = self.tree[2 * i + 1] + self.tree[2 * i + 2]  # self.update_node(i)
+        kajit.update_from_leaf(self.tree, i)
+
+    def modify_many(self, data_items, indices):
+        # Like modify(), for several data items at once: all leaves are set before propagating.
+        first = self.first_data_item
+        for data_item, index in zip(data_items, indices):
+            self.tree[index + first] = data_item
+        for index in indices:
+            kajit.update_from_leaf(self.tree, index + first)
 
     def draw_node(self, rv):
-        i = 0  # index of the root
-        stop = (self.last_data_item - 1) // 2  # parent of the last data item
-        while i <= stop:
-            left = 2 * i + 1
-            right = 2 * i + 2
-            l_value = self.tree[left]
-            if rv < l_value:  # go left
-                i = left
-            else:  # go right
-                rv = rv - l_value
-                i = right
-        # This is the index of the entity associated with the selected data item
-        return i - self.first_data_item
+        # The descent is done by the compiled kernel; CTMC.select_reaction() calls it directly.
+        return kajit.draw_node(self.tree, self.first_data_item, self.last_data_item, rv)
+
+    def draw_node_excluding(self, rv, index, weight):
+        # Draw as if 'weight' were removed from the data item at 'index', without modifying the tree.
+        return kajit.draw_node_excluding(self.tree, self.first_data_item, self.last_data_item, self.height,
+                                         rv, index, weight)
 
     def show(self, pp_width=40):
         """
@@ -6,6 +6,12 @@ import os
 import sys
 import re
 import argparse
+from pathlib import Path
+
+# The jit cache of the compiled kernels (kajit) is shared by all runs, including the parallel workers
+# of a sweep. numba reads this variable when it is first imported, which happens through kasim below;
+# it has no effect if numba was imported before kainit.
+os.environ.setdefault('NUMBA_CACHE_DIR', str(Path.home() / '.sitesim_numba_cache'))
 
 import kasystem as ka
 import kaparam
@@ -149,11 +155,30 @@ def commandline(invocation=None):
                         ka.system.xargs.arg_dict[item_list[0]] = item_list[1:]
     return ka.system
 
-def initialize(parameter_file=None, modifier_fun=None, **kwargs):
+
+# the System attributes that commandline() sets
+COMMANDLINE_SETTINGS = ('cmdline', 'signature_string', 'parameter_file', 'report_file', 'mixture_file',
+                        'db_level', 'rng_seed')
+
+
+def commandline_settings():
     """
-    Initializes the system
+    Returns the command line settings stored in the system, for initialize(settings=...) to reproduce them
+    in a fresh system (after clear_SiteSim(), or in another process).
     """
-    if not ka.system:
+    return {key: getattr(ka.system, key) for key in COMMANDLINE_SETTINGS}
+
+
+def initialize(parameter_file=None, modifier_fun=None, settings=None, **kwargs):
+    """
+    Initializes the system. With 'settings' (see commandline_settings()), the system is created afresh
+    from them, independently of any system left in the global ka.system.
+    """
+    if settings is not None:
+        ka.init_system()
+        for key, value in settings.items():
+            setattr(ka.system, key, value)
+    elif not ka.system:
         # this creates, but does not fully initialize, the global object "system"
         ka.init_system()
 
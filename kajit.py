@@ -0,0 +1,136 @@
+# Walter Fontana, 2023
+"""
+This module collects the compiled kernels used on the hot path of reaction selection.
+
+The kernels are jit-compiled on first use and cached on disk. To avoid the compilation at the start
+of a run altogether, build the ahead-of-time extension module 'kajit_aot' once with
+
+    python kajit.py
+
+When present, it supersedes the jit versions. (The build uses numba.pycc, which numba has deprecated
+and will remove; the jit versions with their disk cache do not depend on it.)
+
+Setting the environment variable SITESIM_NUMBA=0 runs the kernels as ordinary Python functions.
+kainit points the jit cache to ~/.sitesim_numba_cache (unless NUMBA_CACHE_DIR says otherwise), so that all
+runs, including the parallel workers of a parameter sweep, share the compiled kernels.
+"""
+
+import os
+import sys
+import numpy as np
+
+USE_NUMBA = os.environ.get('SITESIM_NUMBA', '1') != '0'
+
+# numba is optional: without it, the kernels below run as ordinary Python functions.
+try:
+    if not USE_NUMBA:
+        raise ImportError
+    from numba import njit
+except ImportError:  # pragma: no cover
+    USE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+
+@njit(cache=True)
+def draw_node(tree, first_data_item, last_data_item, rv):
+    """
+    Descends the heap 'tree' guided by 'rv' and returns the index of the selected data item.
+    (This is kaheap.Heap.draw_node() operating directly on the tree array.)
+    """
+    i = 0  # index of the root
+    while i < first_data_item:
+        # scan the 4 children of i (4*i+1 ... 4*i+4), discounting those we pass
+        c = 4 * i + 1
+        last = c + 3
+        while c < last:
+            value = tree[c]
+            if rv < value:
+                break
+            rv -= value
+            c += 1
+        i = c
+    # Round-off in the (float32) sums may carry an rv at the very top of a subtree past its last
+    # nonzero leaf; the intended item is then the nearest preceding one with nonzero weight.
+    while tree[i] <= 0. and i > first_data_item:
+        i -= 1
+    # This is the index of the entity associated with the selected data item
+    return i - first_data_item
+
+
+@njit(cache=True)
+def update_from_leaf(tree, i):
+    """
+    Propagates a change at node i of the heap 'tree' up to the root.
+    """
+    while i > 0:
+        i = (i - 1) // 4  # parent of i
+        c = 4 * i + 1
+        tree[i] = tree[c] + tree[c + 1] + tree[c + 2] + tree[c + 3]
+
+
+@njit(cache=True)
+def draw_node_excluding(tree, first_data_item, last_data_item, height, rv, exclude, weight):
+    """
+    Like draw_node(), but as if 'weight' were subtracted from the data item at index 'exclude'.
+    The tree is not modified.
+    """
+    # The ancestor of the affected leaf at depth t is (4**t - 1)//3 + (exclude >> 2*(height-t)):
+    # the first index at depth t plus the leaf's position at depth height, coarse-grained by 4**(height-t).
+    shift = 2 * (height - 1)
+    level = 1  # first index at the depth of the children of i
+    i = 0  # index of the root
+    while i < first_data_item:
+        ancestor = level + (exclude >> shift)
+        c = 4 * i + 1
+        last = c + 3
+        while c < last:
+            value = tree[c]
+            if c == ancestor:
+                value -= weight
+            if rv < value:
+                break
+            rv -= value
+            c += 1
+        i = c
+        level = 4 * level + 1
+        shift -= 2
+    # as in draw_node(), step back from a leaf without (remaining) weight
+    leaf = first_data_item + exclude
+    while i > first_data_item and (tree[i] <= 0. or (i == leaf and tree[i] - weight <= 0.)):
+        i -= 1
+    return i - first_data_item
+
+
+def warm_up():
+    """
+    Calls each kernel once with arguments of the types used in a run, so that compilation (or loading
+    from the disk cache) happens at initialization rather than at the first reaction event.
+    """
+    if not USE_NUMBA:
+        return
+    tree = np.ones(5, dtype=np.float32)  # a root with 4 leaves (see kaheap.TREE_DTYPE)
+    draw_node(tree, 1, 4, 0.5)
+    draw_node_excluding(tree, 1, 4, 1, 0.5, 0, 0.5)
+    update_from_leaf(tree, 4)
+
+
+if __name__ == '__main__':
+    # ahead-of-time compilation of the kernels into the extension module kajit_aot
+    if not USE_NUMBA:
+        sys.exit('AOT build requires numba')
+    from numba.pycc import CC
+
+    cc = CC('kajit_aot')
+    cc.export('draw_node', 'i8(f4[:], i8, i8, f8)')(draw_node.py_func)
+    cc.export('draw_node_excluding', 'i8(f4[:], i8, i8, i8, f8, i8, f8)')(draw_node_excluding.py_func)
+    cc.export('update_from_leaf', 'void(f4[:], i8)')(update_from_leaf.py_func)
+    cc.compile()
+elif USE_NUMBA:
+    try:
+        from kajit_aot import draw_node, draw_node_excluding, update_from_leaf
+    except ImportError:
+        pass
@@ -6,6 +6,8 @@ This module manages the 'mixture' of KappaMolecules.
 
 import pprint
 import json
+import math
+import itertools
 
 import kasnap as snap
 import kasystem as ka
@@ -76,18 +78,22 @@ class Mixture(snap.SnapShot):
             self.canonical[mol.canonical] = mol
             kamol.sort_site_and_bond_lists(mol)  # to sync with list states at time of snapshot
 
+        # bond types in signature order; activities by bond type are lists indexed by the bond type id
+        self.bond_types = tuple(self.sys.signature.bond_types)
+        self.bt_id = {bt: i for i, bt in enumerate(self.bond_types)}
+
         # ------ only tracking
         self.total_bond_type = {}
 
         # ------ unimolecular reaction activities
-        self.activity_unimolecular_binding = {}  # unimolecular activity: intra-molecular bond formation
-        self.activity_bond_dissociation = {}     # unimolecular activity: bond dissociation
+        self.activity_unimolecular_binding = []  # unimolecular activity: intra-molecular bond formation
+        self.activity_bond_dissociation = []     # unimolecular activity: bond dissociation
 
         self.unimolecular_reactivity_of_mixture()
 
         # ------ bimolecular reaction activities
         self.total_free_sites = {}
-        self.activity_bimolecular_binding = {}  # bimolecular activity: inter-molecular bond formation
+        self.activity_bimolecular_binding = []  # bimolecular activity: inter-molecular bond formation
 
         self.bimolecular_reactivity_of_mixture()
 
@@ -99,6 +105,8 @@ class Mixture(snap.SnapShot):
 
         # ------ total system activities
         self.total_activity = 0
+        self.inv_total_activity = math.inf  # 1 / total_activity, for the waiting times
+        # (by kind of channel, as of the last resync or update_stratified_activities())
         self.unimolecular_binding_activity = 0.
         self.bond_dissociation_activity = 0.
         self.bimolecular_binding_activity = 0.
@@ -106,23 +114,37 @@ class Mixture(snap.SnapShot):
         self.total_inflow = 0.
         self.total_outflow = 0.
 
+        # Flat vector of channel activities: ub, bd, bb by bond type (in signature order), followed by
+        # inflow and outflow by atom type (see CTMC._channel_kinds).
+        # It is the only record that tally() updates; the activities by kind of channel above are
+        # recomputed at resync and derived from it by update_stratified_activities().
+        # CTMC.select_reaction() locates a channel by binary search in the cumulative activities.
+        # (A channel with zero activity has an empty interval, which the search never lands on.)
+        # Both are lists: element-wise updates of a Python list are cheaper than of a numpy array.
+        n_channels = 3 * len(self.bond_types) + len(self.activity_inflow) + len(self.activity_outflow)
+        self.activity = [0.] * n_channels
+        self.cum_activity = [0.] * n_channels
+        # position of each outflow channel in the flat vector
+        first = 3 * len(self.bond_types) + len(self.activity_inflow)
+        self.outflow_channel = {a: first + j for j, a in enumerate(self.activity_outflow)}
+
         self.update_overall_activities()
 
     def unimolecular_reactivity_of_mixture(self):
         """
         Computes the unimolecular reactivity (dissociation and intra-molecular binding) of the mixture.
         """
-        for bt in self.sys.signature.bond_types:
-            self.activity_unimolecular_binding[bt] = 0.  # activity intra-molecular bond formation
-            self.activity_bond_dissociation[bt] = 0.     # activity bond dissociation
+        self.activity_unimolecular_binding = [0.] * len(self.bond_types)  # activity intra-molecular bond formation
+        self.activity_bond_dissociation = [0.] * len(self.bond_types)     # activity bond dissociation
+        for bt in self.bond_types:
             self.total_bond_type[bt] = 0                 # only tracking
 
         for m in self.complexes:
-            for bt in self.sys.signature.bond_types:
+            for i, bt in enumerate(self.bond_types):
                 # multiplication with rate constant occurred when creating m
-                self.activity_unimolecular_binding[bt] += (m.binding[bt] * m.count)
+                self.activity_unimolecular_binding[i] += (m.binding[bt] * m.count)
                 # multiplication with rate constant occurred when creating m
-                self.activity_bond_dissociation[bt] += (m.unbinding[bt] * m.count)
+                self.activity_bond_dissociation[i] += (m.unbinding[bt] * m.count)
                 # tracking
                 self.total_bond_type[bt] += (m.bond_type[bt] * m.count)
 
@@ -130,8 +152,7 @@ class Mixture(snap.SnapShot):
         """
         Computes the bimolecular binding reactivity of the mixture.
         """
-        for bt in self.sys.signature.bond_types:
-            self.activity_bimolecular_binding[bt] = 0.  # activity inter-molecular bond formation
+        self.activity_bimolecular_binding = [0.] * len(self.bond_types)  # activity inter-molecular bond formation
         # accumulate free_site counts across mixture
         for st in self.sys.signature.site_types:
             self.total_free_sites[st] = 0
@@ -140,7 +161,7 @@ class Mixture(snap.SnapShot):
                 self.total_free_sites[st] += (m.free_site[st] * m.count)
 
         for m in self.complexes:
-            for bt in self.sys.signature.bond_types:
+            for i, bt in enumerate(self.bond_types):
                 st1, st2 = bt
                 factor = 1.
                 if st1 == st2:  # symmetry correction
@@ -151,7 +172,7 @@ class Mixture(snap.SnapShot):
                 # summing over all inter-molecular bond formation *between* molecular
                 # species m and all others yields (see Overleaf notes for the calculation):
                 a += m.free_site[st1] * m.count * (self.total_free_sites[st2] - m.free_site[st2] * m.count)
-                self.activity_bimolecular_binding[bt] += (a * factor * self.sys.rc_bond_formation_inter)
+                self.activity_bimolecular_binding[i] += (a * factor * self.sys.rc_bond_formation_inter)
 
     def flow_activity_of_mixture(self):
         """
@@ -174,57 +195,112 @@ class Mixture(snap.SnapShot):
         This updates the aggregate binding and unbinding activities in the mixture stratified by bond or site type,
         as affected by the loss of a single molecule.
         """
-        for bt in m.signature.bond_types:
-            # unimolecular channels
-            self.activity_unimolecular_binding[bt] -= m.binding[bt]
-            self.activity_bond_dissociation[bt] -= m.unbinding[bt]
-            # bimolecular channels
-            st1, st2 = bt
-            a = m.free_site[st1] * m.free_site[st2] * (m.count - 1)
-            a += m.free_site[st1] * (self.total_free_sites[st2] - m.free_site[st2] * m.count)
-            if st1 != st2:
-                a += m.free_site[st2] * m.free_site[st1] * (m.count - 1)
-                a += m.free_site[st2] * (self.total_free_sites[st1] - m.free_site[st1] * m.count)
-            self.activity_bimolecular_binding[bt] -= a * self.sys.rc_bond_formation_inter
-            # only tracking
-            self.total_bond_type[bt] -= m.bond_type[bt]
-        # update the total number of free sites per type
-        for st in m.free_site:
-            self.total_free_sites[st] -= m.free_site[st]
-
-        # outflow is restricted to atoms (for now)
-        if self.sys.outflow_rate and m.size == 1:
-            agent_type = m.agents[next(iter(m.agents))]['info']['type']
-            self.activity_outflow[agent_type] -= self.sys.outflow_rate[agent_type]
-            self.total_outflow -= self.sys.outflow_rate[agent_type]
+        self.tally((m,), -1)
 
     def positiveUpdate(self, m):
         """
         This updates the aggregate binding and unbinding activities in the mixture stratified by bond or site type,
         as affected by the gain of a single molecule.
         """
-        for st in m.free_site:
-            self.total_free_sites[st] += m.free_site[st]
-        for bt in m.signature.bond_types:
+        self.tally((m,), 1)
+
+    def resync_activities(self):
+        """
+        Recomputes all activities from the mixture, discarding the round-off accumulated by the
+        incremental updates.
+        """
+        self.unimolecular_reactivity_of_mixture()
+        self.bimolecular_reactivity_of_mixture()
+        # outflow channels are fixed at initialization (see flow_activity_of_mixture)
+        for a in self.activity_outflow:
+            self.activity_outflow[a] = 0.
+        for m in self.complexes:
+            if m.size == 1:
+                atom_type = m.agents[next(iter(m.agents))]['info']['type']
+                if atom_type in self.activity_outflow:
+                    self.activity_outflow[atom_type] += m.count * self.sys.outflow_rate[atom_type]
+        self.update_overall_activities()
+
+    def apply_delta(self, dec_mols, inc_mols):
+        """
+        Accounts for the loss of one instance of each molecule in 'dec_mols' (the same species may appear
+        twice) and for the gain of the reaction products in 'inc_mols'. The activities of each side are updated
+        in a single pass over bond types, and each heap receives one batched update.
+        Since a reaction modifies a reactant in place when its count drops to zero, the products only exist
+        after the reactants have been accounted for: call this with the reactants before the reaction and
+        with the products after it.
+        """
+        if dec_mols:
+            self.tally(dec_mols, -1)
+            for m in dec_mols:
+                m.count -= 1
+            species = list(dict.fromkeys(dec_mols))
+            survivors = [m for m in species if m.count > 0]
+            if survivors:
+                # update the heaps before removals shift the indices
+                sim = self.sys.sim
+                indices = [self.index[m] for m in survivors]
+                for bt, h in sim.heap_btp.items():
+                    h.modify_many([m.binding[bt] * m.count for m in survivors], indices)
+                for bt, h in sim.heap_btm.items():
+                    h.modify_many([m.unbinding[bt] * m.count for m in survivors], indices)
+                for st, h in sim.heap_st.items():
+                    h.modify_many([m.free_site[st] * m.count for m in survivors], indices)
+            for m in species:
+                if m.count == 0:
+                    self.remove_molecular_species(m)
+        if inc_mols:
+            for new in inc_mols:
+                self.update_mixture(new)
+            self.tally(inc_mols, 1)
+
+    def tally(self, mols, sign):
+        """
+        Updates the activities stratified by bond or site type for the loss (sign = -1) or gain (sign = 1)
+        of one instance of each molecule in 'mols'. This is negativeUpdate() or positiveUpdate() for
+        all of 'mols' at once. The changes are applied as deltas to the flat vector of channel activities,
+        so that only the cumulative activities remain to be refreshed.
+        """
+        # The bimolecular activity of bt = (s1, s2) is rc * (T1 * T2 - P) over all pairs of distinct instances,
+        # with T the free-site totals and P the sum of f1 * f2 over instances (halved if s1 == s2).
+        # Adding (sign = 1) or removing (sign = -1) instances with free-site sums F and product sum p
+        # changes it by rc * (sign * (F1 * T2 + F2 * T1 - p) + F1 * F2), with T prior to the change.
+        totals = self.total_free_sites
+        F = dict.fromkeys(totals, 0)
+        for m in mols:
+            for st in m.free_site:
+                F[st] += m.free_site[st]
+        rc = self.sys.rc_bond_formation_inter
+        activity = self.activity
+        n_bt = len(self.bond_types)
+        for i, bt in enumerate(self.bond_types):
+            st1, st2 = bt
+            binding = unbinding = bonds = p = 0
+            for m in mols:
+                binding += m.binding[bt]
+                unbinding += m.unbinding[bt]
+                bonds += m.bond_type[bt]
+                p += m.free_site[st1] * m.free_site[st2]
             # unimolecular channels
-            self.activity_unimolecular_binding[bt] += m.binding[bt]
-            self.activity_bond_dissociation[bt] += m.unbinding[bt]
+            activity[i] += sign * binding
+            activity[n_bt + i] += sign * unbinding
             # bimolecular channels
-            st1, st2 = bt
-            a = m.free_site[st1] * m.free_site[st2] * (m.count - 1)
-            a += m.free_site[st1] * (self.total_free_sites[st2] - m.free_site[st2] * m.count)
-            if st1 != st2:
-                a += m.free_site[st2] * m.free_site[st1] * (m.count - 1)
-                a += m.free_site[st2] * (self.total_free_sites[st1] - m.free_site[st1] * m.count)
-            self.activity_bimolecular_binding[bt] += a * self.sys.rc_bond_formation_inter
+            a = sign * (F[st1] * totals[st2] + F[st2] * totals[st1] - p) + F[st1] * F[st2]
+            if st1 == st2:  # symmetry correction
+                a *= 0.5
+            activity[2 * n_bt + i] += a * rc
             # only tracking
-            self.total_bond_type[bt] += m.bond_type[bt]
+            self.total_bond_type[bt] += sign * bonds
+        # update the total number of free sites per type
+        for st in F:
+            totals[st] += sign * F[st]
 
         # outflow is restricted to atoms (for now)
-        if self.sys.outflow_rate and m.size == 1:
-            agent_type = m.agents[next(iter(m.agents))]['info']['type']
-            self.activity_outflow[agent_type] += self.sys.outflow_rate[agent_type]
-            self.total_outflow += self.sys.outflow_rate[agent_type]
+        if self.sys.outflow_rate:
+            for m in mols:
+                if m.size == 1:
+                    agent_type = m.agents[next(iter(m.agents))]['info']['type']
+                    activity[self.outflow_channel[agent_type]] += sign * self.sys.outflow_rate[agent_type]
 
     def update_overall_activities(self):
         """
@@ -232,31 +308,48 @@ class Mixture(snap.SnapShot):
             unimolecular binding
             bimolecular binding
             dissociation
+        (tally() keeps the flat vector up to date incrementally; this rebuilds it from the stratified activities.)
         """
-        self.total_activity = 0
-        self.unimolecular_binding_activity = 0.
-        self.bond_dissociation_activity = 0.
-        self.bimolecular_binding_activity = 0.
-        for bt in self.sys.signature.bond_types:
-            self.unimolecular_binding_activity += self.activity_unimolecular_binding[bt]
-            self.bond_dissociation_activity += self.activity_bond_dissociation[bt]
-            self.bimolecular_binding_activity += self.activity_bimolecular_binding[bt]
-        self.total_activity += self.unimolecular_binding_activity
-        self.total_activity += self.bond_dissociation_activity
-        self.total_activity += self.bimolecular_binding_activity
-
-        if self.sys.inflow_rate or self.sys.outflow_rate:
-            self.total_inflow = 0.
-            self.total_outflow = 0.
-            for a in self.sys.inflow_rate:
-                # inflows are zero-molecular
-                self.total_inflow += self.activity_inflow[a]
-            for a in self.sys.outflow_rate:
-                # outflows are unimolecular
-                self.total_outflow += self.activity_outflow[a]
-
-            self.total_activity += self.total_inflow
-            self.total_activity += self.total_outflow
+        self.activity[:] = (self.activity_unimolecular_binding
+                            + self.activity_bond_dissociation
+                            + self.activity_bimolecular_binding
+                            + [*self.activity_inflow.values(), *self.activity_outflow.values()])
+
+        self.unimolecular_binding_activity = sum(self.activity_unimolecular_binding)
+        self.bond_dissociation_activity = sum(self.activity_bond_dissociation)
+        self.bimolecular_binding_activity = sum(self.activity_bimolecular_binding)
+        # inflows are zero-molecular, outflows are unimolecular
+        self.total_inflow = sum(self.activity_inflow.values())
+        self.total_outflow = sum(self.activity_outflow.values())
+
+        self.update_cumulative_activities()
+
+    def update_stratified_activities(self):
+        """
+        Derives the activities by kind of channel and their totals from the flat vector, which is all
+        that tally() updates between resyncs.
+        """
+        n_bt = len(self.bond_types)
+        self.activity_unimolecular_binding = self.activity[:n_bt]
+        self.activity_bond_dissociation = self.activity[n_bt:2 * n_bt]
+        self.activity_bimolecular_binding = self.activity[2 * n_bt:3 * n_bt]
+        for a in self.activity_outflow:
+            self.activity_outflow[a] = self.activity[self.outflow_channel[a]]
+
+        self.unimolecular_binding_activity = sum(self.activity_unimolecular_binding)
+        self.bond_dissociation_activity = sum(self.activity_bond_dissociation)
+        self.bimolecular_binding_activity = sum(self.activity_bimolecular_binding)
+        self.total_outflow = sum(self.activity_outflow.values())
+
+    def update_cumulative_activities(self):
+        """
+        Refreshes the cumulative channel activities and the total after an event.
+        """
+        self.cum_activity = list(itertools.accumulate(self.activity))
+        # the total is the last cumulative activity, so that any rv < total_activity lands on a channel
+        self.total_activity = self.cum_activity[-1] if self.cum_activity else 0.
+        # a system without activity never reacts again
+        self.inv_total_activity = 1. / self.total_activity if self.total_activity > 0. else math.inf
 
     def remove_molecular_species(self, m):
         """
@@ -289,9 +382,10 @@ class Mixture(snap.SnapShot):
         # update
         self.number_of_species -= 1
         # update the heap (using the index prior to deletion in complexes[])
-        for t in ['bt+', 'bt-', 'st']:
-            for k in self.sys.sim.heap[t]:
-                self.sys.sim.heap[t][k].delete(remove)
+        sim = self.sys.sim
+        for heaps in (sim.heap_btp, sim.heap_btm, sim.heap_st):
+            for k in heaps:
+                heaps[k].delete(remove)
 
     def add_molecular_species(self, m):
         """
@@ -308,15 +402,16 @@ class Mixture(snap.SnapShot):
 
         self.number_of_species += 1
         # update the heap
-        for st in self.sys.sim.heap['st']:
+        sim = self.sys.sim
+        for st in sim.heap_st:
             data_item = m.free_site[st] * m.count
-            self.sys.sim.heap['st'][st].insert(data_item)
-        for bt in self.sys.sim.heap['bt+']:
+            sim.heap_st[st].insert(data_item)
+        for bt in sim.heap_btp:
             data_item = m.binding[bt] * m.count
-            self.sys.sim.heap['bt+'][bt].insert(data_item)
-        for bt in self.sys.sim.heap['bt-']:
+            sim.heap_btp[bt].insert(data_item)
+        for bt in sim.heap_btm:
             data_item = m.unbinding[bt] * m.count
-            self.sys.sim.heap['bt-'][bt].insert(data_item)
+            sim.heap_btm[bt].insert(data_item)
 
     def change_count(self, m, num, remove=True):
         """
@@ -328,13 +423,13 @@ class Mixture(snap.SnapShot):
             self.remove_molecular_species(m)
         else:
             # update the heap
-            hp = self.sys.sim.heap['st']
+            hp = self.sys.sim.heap_st
             for st in hp:
                 hp[st].modify(m.free_site[st] * m.count, self.index[m])
-            hp = self.sys.sim.heap['bt+']
+            hp = self.sys.sim.heap_btp
             for bt in hp:
                 hp[bt].modify(m.binding[bt] * m.count, self.index[m])
-            hp = self.sys.sim.heap['bt-']
+            hp = self.sys.sim.heap_btm
             for bt in hp:
                 hp[bt].modify(m.unbinding[bt] * m.count, self.index[m])
 
@@ -393,6 +488,7 @@ class Mixture(snap.SnapShot):
             if self.sys.monitor.reproducible:
                 # if we want the option of a continuation, we need to supply the local views
                 # and the state of the random number generator
+                self.sys.sim.flush_random_buffer()
                 s += f'// RG state : {json.dumps(self.sys.sim.rng.bit_generator.state)}\n'
                 s += f'// LV : {json.dumps(self.local_views)}\n'
             s += f'%def: "T0" "{self.sys.sim.time}"\n'
@@ -411,6 +507,7 @@ class Mixture(snap.SnapShot):
         """
         Summarizes the mixture.
         """
+        self.update_stratified_activities()
         info = f"\n{'MIXTURE '.ljust(70, '-')}\n\n"
         info += f'{"initial mixture file":>20}: {self.file}\n'
         info += f'{"molecular species":>20}: {self.number_of_species}\n'
@@ -442,17 +539,17 @@ class Mixture(snap.SnapShot):
         info += '\n'
         info += f'{"system activities by bond type ":>{pp_width}}\n'
         info += f'{"unimolecular binding activity ":>{pp_width}}\n'
-        for bt in self.sys.signature.bond_types:
+        for i, bt in enumerate(self.bond_types):
             s = f'{bt}'
-            info += f'{s:>{pp_width}}: {self.activity_unimolecular_binding[bt]:{form}}\n'
+            info += f'{s:>{pp_width}}: {self.activity_unimolecular_binding[i]:{form}}\n'
         info += f'{"bond dissociation activity ":>{pp_width}}\n'
-        for bt in self.sys.signature.bond_types:
+        for i, bt in enumerate(self.bond_types):
             s = f'{bt}'
-            info += f'{s:>{pp_width}}: {self.activity_bond_dissociation[bt]:{form}}\n'
+            info += f'{s:>{pp_width}}: {self.activity_bond_dissociation[i]:{form}}\n'
         info += f'{"bimolecular binding activity ":>{pp_width}}\n'
-        for bt in self.sys.signature.bond_types:
+        for i, bt in enumerate(self.bond_types):
             s = f'{bt}'
-            info += f'{s:>{pp_width}}: {self.activity_bimolecular_binding[bt]:{form}}\n'
+            info += f'{s:>{pp_width}}: {self.activity_bimolecular_binding[i]:{form}}\n'
         info += f'{"inflow activity ":>{pp_width}}\n'
         for a in self.sys.inflow_rate:
             s = f'atom type {a}'
@@ -1,5 +1,6 @@
 # Walter Fontana, 2022
 
+import heapq
 import math
 import re
 import sys
@@ -9,6 +10,9 @@ from collections import deque
 import kamol
 import kasystem as ka
 
+# kinds of scheduled null events (observations come first when both are due)
+OBSERVATION, SNAPSHOT = 0, 1
+
 
 class Monitor:
     """
@@ -69,6 +73,10 @@ class Monitor:
 
         self.observation_time = 0
         self.snap_time = 0
+        # The scheduled "null events" (observations, snapshots) form a heap of (time, kind); an entry is
+        # superseded once the time of its kind has moved on. next_trigger is the time at the top of the heap.
+        self.schedule = []
+        self.next_trigger = 0
 
         self.name_form = ''
 
@@ -292,6 +300,9 @@ class Monitor:
 
         if self.snap_period == 0:
             self.snap_time = ka.system.sim_limit
+        self.schedule = []
+        self.reschedule(OBSERVATION, self.observation_time)
+        self.reschedule(SNAPSHOT, self.snap_time)
 
         # generate the column labels for the monitor file and
         # a "by name" indexed copy of the dictionary of observables
@@ -427,6 +438,7 @@ class Monitor:
             fp.write(info + '\n')
 
         self.observation_time += self.obs_period
+        self.reschedule(OBSERVATION, self.observation_time)
 
     def snapshot(self, flag=''):
         """
@@ -447,4 +459,41 @@ class Monitor:
         self.snap_counter += 1
 
         self.snap_time += self.snap_period
+        self.reschedule(SNAPSHOT, self.snap_time)
+
+    def fire(self, t):
+        """
+        Carries out the observation and/or snapshot due at time (or event) t, i.e. when t has reached
+        next_trigger. Returns True if an observation was made.
+        """
+        schedule = self.schedule
+        due = set()
+        while schedule and schedule[0][0] <= t:
+            time, kind = heapq.heappop(schedule)
+            if time == self.scheduled_time(kind):
+                due.add(kind)
+        # each kind is carried out once (observations first), even if its next time is also due
+        for kind in sorted(due):
+            if kind == OBSERVATION:
+                self.observe()
+            else:
+                self.snapshot()
+        return OBSERVATION in due
+
+    def scheduled_time(self, kind):
+        """
+        The current time (or event) of the next null event of the given kind.
+        """
+        return self.observation_time if kind == OBSERVATION else self.snap_time
+
+    def reschedule(self, kind, time):
+        """
+        Schedules the next null event of the given kind and updates next_trigger.
+        """
+        schedule = self.schedule
+        heapq.heappush(schedule, (time, kind))
+        # drop superseded entries from the top
+        while schedule[0][0] != self.scheduled_time(schedule[0][1]):
+            heapq.heappop(schedule)
+        self.next_trigger = schedule[0][0]
 
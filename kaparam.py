@@ -81,6 +81,10 @@ class Parameters:
 
         self.rng_seed = None
 
+        # selection of molecular species: 'heap' (sum trees) or 'cr' (composition-rejection) ---
+
+        self.selection = 'heap'
+
         # signature string -------------------------------------------------------
 
         self.signature_string = None
@@ -195,7 +199,7 @@ class Parameters:
         Current keywords:
             'Volume', 'Kd_weak', 'Kd_medium', 'Kd_strong', 'k_on', 'Resize', 'RingClosureFactor',
             'seed', 'inflow', 'outflow', 'sim_limit', 'obs_frequency', 'report_fn', 'snap_root',
-            'output_fn', 'numbering'
+            'output_fn', 'numbering', 'selection'
         """
         if not os.path.isfile(par_file):
             sys.exit("Cannot find parameter file %s" % par_file)
@@ -280,6 +284,11 @@ class Parameters:
                                 elif name == 'seed':
                                     if value != 'None':
                                         self.rng_seed = int(value)
+                                elif name == 'selection':
+                                    if value in ('heap', 'cr'):
+                                        self.selection = value
+                                    else:
+                                        sys.exit(f'No such selection method: {value}')
                                 elif name == "memory":
                                     ka.system.monitor.memory = int(value)
                                 elif name == 'inflow':
@@ -374,6 +383,7 @@ class Parameters:
         info += '\n'
 
         info += f'{"random number seed":>{pp_width}}: {self.rng_seed}\n'
+        info += f'{"species selection":>{pp_width}}: {self.selection}\n'
 
         return info
 
@@ -19,6 +19,7 @@ class KappaSignature:
                                 }
 
         self.site_types = [a.s, ...]
+        self.site_suffix[a.s] = s
         self.bond_types[(a1, s1), (a2, s2)] = affinity
              bond types ( (a1, s1), (a2, s2) ) are sorted first by agent type and then by site type
         self.init_agents[a] = init_amount (in nM) or '*' (default)
@@ -35,6 +36,7 @@ class KappaSignature:
         self.signature = {}  # the signature data structure
         self.init_agents = {}  # a dictionary declaring the initial concentration of an agent in nM
         self.site_types = []  # a list of site types
+        self.site_suffix = {}  # the site name of each site type: self.site_suffix['A.p'] = 'p'
         # A dictionary of bond types and affinities; in the signature they can be indicated
         # as w(eak), m(edium), s(trong), def(ault) or a specific magnitude in nM
         self.bond_types = {}
@@ -170,12 +172,14 @@ class KappaSignature:
     def get_site_and_bond_types(self):
         """
         Construct the bond_types dictionary and clean bond lists in 'signature' from decorations.
-        Construct the site_types list.
+        Construct the site_types list and the site_suffix lookup.
         """
         bond_types = {}
         for agent in self.signature:
             for site in self.signature[agent]:
-                self.site_types += [''.join([agent, '.', site])]
+                site_type = ''.join([agent, '.', site])
+                self.site_types += [site_type]
+                self.site_suffix[site_type] = site
                 bonds = self.signature[agent][site]['bonds']  # list of bonds
                 clean_bonds = []
                 for bb in bonds:
@@ -5,12 +5,18 @@ This module defines the simulation engine.
 
 import kasystem as ka
 import kaheap
+import kacr
+import kajit
 import kareact as react
 
 import numpy as np
-import sys
+import bisect
+import functools
 import json
 
+# kinds of reaction channels, in the order of Mixture.activity; these index both CTMC._select and CTMC._dispatch
+UB, BD, BB, INFLOW, OUTFLOW = 0, 1, 2, 3, 4
+
 
 class CTMC:
     """
@@ -21,10 +27,15 @@ class CTMC:
         self.sys = ka.system
         self.mix = ka.system.mixture
         self.sig = ka.system.signature
+        # bond types in signature order; this is the order of the activities by bond type in the mixture
+        self._bond_types = self.mix.bond_types
 
         self.time = ka.system.mixture.time  # we inherit the initial time from the mixture
         self.event = ka.system.mixture.event  # we inherit the initial event number from the mixture
 
+        # The selected reaction is [channel, [molecule1, molecule2], (agent1, site1), (agent2, site2)].
+        # select_reaction() fills the buffer self._reaction in place rather than allocating per event.
+        self._reaction = [None, [None, None], (None, None), (None, None)]
         self.current_reaction = None
 
         # initialize random number generator
@@ -32,213 +43,422 @@ class CTMC:
         # self.rng = np.random.default_rng(seed=ka.system.parameters.rng_seed)
         # [use np.random.MT19937(seed) for compatibility with RandomState]
         # restore state, if desired (mainly for continuation of a simulation)
-        if ka.system.mixture.rg_state:
+        if ka.system.restore_rg_state and ka.system.mixture.rg_state:
             self.rng.bit_generator.state = ka.system.mixture.rg_state
-
-        # collection of heaps to speed up reaction selection
-        self.heap = {'bt+': {}, 'bt-': {}, 'st': {}}
+        # buffers of variates drawn in batches: uniform in [0, 1) for reaction selection,
+        # unit exponential for the waiting times
+        self._u_buf_size = 1024
+        self._u_buf = []
+        self._u_i = 0
+        self._exp_buf = []
+        self._exp_i = 0
+        # the activities are updated incrementally; every so many events they are recomputed from scratch
+        self._resync_period = 100000
+        self._resync_countdown = self._resync_period
+
+        # collection of heaps to speed up reaction selection:
+        # binding (bt+) and unbinding (bt-) by bond type, bimolecular binding by site type (st)
+        self.heap_btp = {}
+        self.heap_btm = {}
+        self.heap_st = {}
+        # (the molecular level is indexed by sum-tree heaps or, optionally, by composition-rejection indices)
+        if ka.system.parameters.selection == 'cr':
+            self._make_index = functools.partial(kacr.CRIndex, uniform=self._next_uniform)
+            self._draw = kacr.CRIndex.draw_node
+            self._draw_excluding = kacr.CRIndex.draw_node_excluding
+        else:
+            self._make_index = kaheap.Heap
+            self._draw = kaheap.Heap.draw_node
+            self._draw_excluding = kaheap.Heap.draw_node_excluding
         self.initialize_heaps()
+        # reaction execution by kind of channel, indexed by UB, BD, BB, INFLOW, OUTFLOW
+        self._dispatch = (self._do_ub, self._do_bd, self._do_bb, self._do_inflow, self._do_outflow)
+        # reaction refinement by kind of channel, indexed likewise
+        self._select = (self._select_ub, self._select_bd, self._select_bb, self._select_inflow, self._select_outflow)
+        # for each channel of Mixture.activity: its kind and its key (bond or atom type)
+        mix = self.mix
+        n_bt = len(self._bond_types)
+        self._channel_kinds = ((UB,) * n_bt + (BD,) * n_bt + (BB,) * n_bt
+                               + (INFLOW,) * len(mix.activity_inflow) + (OUTFLOW,) * len(mix.activity_outflow))
+        self._channel_keys = self._bond_types * 3 + tuple(mix.activity_inflow) + tuple(mix.activity_outflow)
+        # with few channels, a selection function generated for this system beats the binary search
+        self._max_unrolled_channels = 16
+        self._select_namespace = None
+        self._specialize_select_reaction()
+        # compile the kernels now rather than at the first event
+        kajit.warm_up()
+
+    @property
+    def heap(self):
+        """
+        The heaps in nested form {'bt+': {bt: heap}, 'bt-': {bt: heap}, 'st': {s: heap}}.
+        """
+        return {'bt+': self.heap_btp, 'bt-': self.heap_btm, 'st': self.heap_st}
 
     def initialize_heaps(self):
         """
         Initialize the collection of heaps.
         """
+        complexes = self.mix.complexes
+        bond_types = list(self.sig.bond_types)
         sites = set()
-        for bt in self.sig.bond_types:
-            s1, s2 = bt
+        for s1, s2 in bond_types:
             sites.update([s1, s2])
-
+        sites = list(sites)
+
+        # stack the relevant properties of all complexes once; each heap then gets a column
+        shape = (len(complexes), len(bond_types))
+        counts = np.array([m.count for m in complexes], dtype=np.float64)
+        binding = np.array([[m.binding[bt] for bt in bond_types] for m in complexes], dtype=np.float64)
+        unbinding = np.array([[m.unbinding[bt] for bt in bond_types] for m in complexes], dtype=np.float64)
+        free_site = np.array([[m.free_site[s] for s in sites] for m in complexes], dtype=np.float64)
+        binding = binding.reshape(shape)
+        unbinding = unbinding.reshape(shape)
+        free_site = free_site.reshape((len(complexes), len(sites)))
+
+        for k, bt in enumerate(bond_types):
             # heaps for handling reaction selection based on binding (bt+) and unbinding (bt-)
             # stratified by binding type
-            data = [m.binding[bt] * m.count for m in self.mix.complexes]
-            self.heap['bt+'][bt] = kaheap.Heap(data, ident=f'bt+ | {bt}')
-            data = [m.unbinding[bt] * m.count for m in self.mix.complexes]
-            self.heap['bt-'][bt] = kaheap.Heap(data, ident=f'bt- | {bt}')
+            self.heap_btp[bt] = self._make_index(binding[:, k] * counts, ident=f'bt+ | {bt}')
+            self.heap_btm[bt] = self._make_index(unbinding[:, k] * counts, ident=f'bt- | {bt}')
 
         # heaps for handling reaction selection based on bimolecular binding stratified by site type
-        for s in sites:
-            data = [m.free_site[s] * m.count for m in self.mix.complexes]
-            self.heap['st'][s] = kaheap.Heap(data, ident=f'st | {s}')
+        for k, s in enumerate(sites):
+            self.heap_st[s] = self._make_index(free_site[:, k] * counts, ident=f'st | {s}')
+
+    def step(self, n):
+        """
+        Carries out n reaction events in a row, without any observations in between.
+        """
+        advance = self.advance_time
+        select = self.select_reaction
+        execute = self.execute_reaction
+        for _ in range(n):
+            advance()
+            select()
+            execute()
+        # nothing reads the event counter during a reaction
+        self.event += n
+
+    def run_until(self, t_stop):
+        """
+        Carries out reaction events until the next waiting time carries the clock to or past t_stop, and
+        returns the number of events. The clock is left at the time it reached, so that the caller can
+        treat t_stop as a "null reaction" (an observation or snapshot) or as the end of the simulation.
+        """
+        # This is advance_time() inlined, with the clock and the position in the buffer of exponentials
+        # kept in locals; they are written back on return (nothing reads them during a reaction).
+        mix = self.mix
+        select = self.select_reaction
+        execute = self.execute_reaction
+        t = self.time
+        exp_buf = self._exp_buf
+        i = self._exp_i
+        n_events = 0
+        while True:
+            if i == len(exp_buf):
+                exp_buf = self._exp_buf = self.rng.standard_exponential(self._u_buf_size).tolist()
+                i = 0
+            t += exp_buf[i] * mix.inv_total_activity
+            i += 1
+            if t >= t_stop:
+                break
+            n_events += 1
+            select()
+            execute()
+        self.time = t
+        self._exp_i = i
+        self.event += n_events
+        return n_events
 
     def advance_time(self):
         """
         Simulates time.
         """
-        self.time += self.rng.exponential(scale=1. / self.mix.total_activity)
+        # exponential waiting time, scaled from the buffered unit exponentials
+        i = self._exp_i
+        if i == len(self._exp_buf):
+            self._exp_buf = self.rng.standard_exponential(self._u_buf_size).tolist()
+            i = 0
+        self._exp_i = i + 1
+        self.time += self._exp_buf[i] * self.mix.inv_total_activity
+
+    def _next_uniform(self):
+        """
+        Returns the next uniform variate in [0, 1) from the buffer, refilling it when exhausted.
+        """
+        i = self._u_i
+        if i == len(self._u_buf):
+            self._u_buf = self.rng.random(self._u_buf_size).tolist()
+            i = 0
+        self._u_i = i + 1
+        return self._u_buf[i]
+
+    def uniform(self):
+        """
+        Returns a uniform variate in [0, 1) from the buffered stream. (The hot paths inline
+        self._next_uniform; this is for code outside the simulator.)
+        """
+        return self._next_uniform()
+
+    def randint(self, n):
+        """
+        Returns a uniform integer in [0, n) from the buffered stream, by scaling a uniform variate.
+        """
+        return int(self._next_uniform() * n)
+
+    def flush_random_buffer(self):
+        """
+        Discards the buffered variates. Call this before saving the generator state, so that
+        a continuation from the saved state draws the same numbers as the uninterrupted run.
+        """
+        self._u_buf = []
+        self._u_i = 0
+        self._exp_buf = []
+        self._exp_i = 0
 
     def execute_reaction(self):
         """
         Executes a reaction and updates.
         """
-        choice, (molecule1, molecule2), (agent1, site1), (agent2, site2) = self.current_reaction
-
-        if choice == 'ub':
-            # Unimolecular binding between site1 of agent1 and site2 of agent2 in molecule1.
-            # molecule2 is None.
-
-            # negative update of propensities (before updating reactant counts!)
-            self.mix.negativeUpdate(molecule1)
-            # adjust actual counts (and remove species if count drops to zero)
-            self.mix.change_count(molecule1, -1)
-            # execute the reaction by creating the new molecule(s)
-            new = react.unimolecular_binding(self.current_reaction)
-            # add the product to the mixture (updates product counts)
-            self.mix.update_mixture(new)
-            # positive update of propensities (before updating product counts!)
-            self.mix.positiveUpdate(new)
-
-        elif choice == 'bd':
-            # Bond dissociation between (agent1, site1), (agent2, site2) in molecule1
-
-            self.mix.negativeUpdate(molecule1)
-            self.mix.change_count(molecule1, -1)
-            n_products, product = react.bond_dissociation(self.current_reaction)
-            for i in range(0, n_products):
-                self.mix.update_mixture(product[i])
-                self.mix.positiveUpdate(product[i])
-
-        elif choice == 'bb':
-            # Bimolecular binding between (agent1, site1) in molecule1 and (agent2, site2) in molecule2
-
-            # update logic as for case 'ub'
-            self.mix.negativeUpdate(molecule1)
-            self.mix.change_count(molecule1, -1)
-            self.mix.negativeUpdate(molecule2)
-            self.mix.change_count(molecule2, -1)
-            new = react.bimolecular_binding(self.current_reaction)
-            self.mix.update_mixture(new)
-            self.mix.positiveUpdate(new)
-
-        elif choice == 'inflow':
-            # Inflow of an atom of type declared in 'molecule1'. (In this case, molecule1 is a string.)
-
-            new = react.inflow(molecule1)
-            self.mix.update_mixture(new)
-            self.mix.positiveUpdate(new)
-
-        elif choice == 'outflow':
-            # Outflow of an atom of type declared in 'molecule1'. (In this case, molecule1 is a string.)
-
-            out = react.outflow(molecule1)
-            self.mix.negativeUpdate(out)
-            self.mix.change_count(out, -1)
+        reaction = self.current_reaction
+        self._dispatch[reaction[0]](reaction)
 
+        # update overall propensities
+        self._resync_countdown -= 1
+        if self._resync_countdown:
+            self.mix.update_cumulative_activities()
         else:
-            sys.exit("execute_reaction: Unknown reaction")
+            self._resync_countdown = self._resync_period
+            self.mix.resync_activities()
+            self._specialize_select_reaction()
 
-        # update overall propensities
-        self.mix.update_overall_activities()
+    def _do_inflow(self, reaction):
+        """
+        Inflow of an atom of type declared in 'molecule1'. (In this case, molecule1 is a string.)
+        """
+        molecule1, molecule2 = reaction[1]
 
-    def select_reaction(self):
+        self.mix.apply_delta((), (react.inflow(molecule1),))
+
+    def _do_outflow(self, reaction):
         """
-        Fast reaction selection using heaps.
+        Outflow of an atom of type declared in 'molecule1'. (In this case, molecule1 is a string.)
+        """
+        molecule1, molecule2 = reaction[1]
+
+        self.mix.apply_delta((react.outflow(molecule1),), ())
+
+    def _do_ub(self, reaction):
+        """
+        Unimolecular binding between site1 of agent1 and site2 of agent2 in molecule1. molecule2 is None.
+        """
+        molecule1, molecule2 = reaction[1]
+        mix = self.mix
+
+        # negative update of propensities and reactant counts (removes species if count drops to zero)
+        mix.apply_delta((molecule1,), ())
+        # execute the reaction by creating the new molecule(s)
+        new = react.unimolecular_binding(reaction)
+        # add the product to the mixture and update propensities
+        mix.apply_delta((), (new,))
+
+    def _do_bd(self, reaction):
+        """
+        Bond dissociation between (agent1, site1), (agent2, site2) in molecule1.
         """
+        molecule1, molecule2 = reaction[1]
+        mix = self.mix
 
-        rv = self.rng.uniform(low=0.0, high=self.mix.total_activity)
-
-        if rv < self.mix.unimolecular_binding_activity:
-            # channel is a unimolecular binding event
-            select = 'ub'
-            for bt in self.sig.bond_types:
-                if rv < self.mix.activity_unimolecular_binding[bt]:
-                    # the internal bond to be formed is of type bt
-                    # refine search to the molecular level
-                    m = self.mix.complexes[self.heap['bt+'][bt].draw_node(rv)]
-                    # the event is within molecular species m;
-                    # now we uniformly choose the instance of bt in m
-                    # bt is (agent_type1.site1), (agent_type2.site2)
-                    # NOTE: I don't think we need to randomize which site we choose first.
-                    s1, s2 = bt
-                    r1 = self.rng.integers(low=0, high=m.free_site[s1])
-                    # this is our choice of site1; it belongs to agent name1 in molecule m
-                    name1, site1 = m.free_site_list[s1][r1]
-                    if s1 == s2:
-                        temp_list = [p for p in m.free_site_list[s2] if p != (name1, site1)]
-                        r2 = self.rng.integers(low=0, high=m.free_site[s2] - 1)
-                        name2, site2 = temp_list[r2]
-                    else:
-                        # exclude possibility of self-binding
-                        site2 = s2.split('.')[1]
-                        if (name1, site2) in m.free_site_list[s2]:
-                            temp_list = [p for p in m.free_site_list[s2] if p != (name1, site2)]
-                            r2 = self.rng.integers(low=0, high=m.free_site[s2] - 1)
-                            name2, site2 = temp_list[r2]
-                            self.current_reaction =  select, (m, None), (name1, site1), (name2, site2)
-                            return
-                        else:
-                            r2 = self.rng.integers(low=0, high=m.free_site[s2])
-                            name2, site2 = m.free_site_list[s2][r2]
-                    self.current_reaction = select, (m, None), (name1, site1), (name2, site2)
-                    return
-                else:
-                    rv -= self.mix.activity_unimolecular_binding[bt]
+        mix.apply_delta((molecule1,), ())
+        n_products, product = react.bond_dissociation(reaction)
+        mix.apply_delta((), product[:n_products])
 
+    def _do_bb(self, reaction):
+        """
+        Bimolecular binding between (agent1, site1) in molecule1 and (agent2, site2) in molecule2.
+        """
+        molecule1, molecule2 = reaction[1]
+        mix = self.mix
+
+        # update logic as for case 'ub'
+        mix.apply_delta((molecule1, molecule2), ())
+        new = react.bimolecular_binding(reaction)
+        mix.apply_delta((), (new,))
+
+    def _specialize_select_reaction(self):
+        """
+        For systems with few channels, replaces select_reaction() by a function generated for this system:
+        an unrolled chain of comparisons against the cumulative channel activities, with the refinement
+        and its key (bond or atom type) bound per channel. The channels are tested in order of decreasing
+        activity, so that the common case is decided by the first comparison; execute_reaction() calls this
+        again at every resync to follow the shifting activities.
+        """
+        n = len(self._channel_kinds)
+        if n == 0 or n > self._max_unrolled_channels:
+            return
+        activity = self.mix.activity
+        order = sorted(range(n), key=lambda j: -activity[j])
+        namespace = {'uniform': self._next_uniform, 'mix': self.mix}
+        lines = ['def select_reaction():',
+                 '    cum = mix.cum_activity',
+                 '    rv = uniform() * mix.total_activity']
+        for rank, j in enumerate(order):
+            namespace[f'select{j}'] = self._select[self._channel_kinds[j]]
+            namespace[f'key{j}'] = self._channel_keys[j]
+            residual = f'rv - cum[{j - 1}]' if j else 'rv'
+            # the channel intervals partition [0, total), so they can be tested in any order
+            interval = f'cum[{j - 1}] <= rv < cum[{j}]' if j else f'rv < cum[{j}]'
+            if rank < n - 1:
+                lines.append(f'    {"elif" if rank else "if"} {interval}:')
+            elif rank:
+                lines.append('    else:')
+            else:  # a single channel
+                lines.append('    if True:')
+            lines.append(f'        select{j}(key{j}, {residual})')
+        exec('\n'.join(lines), namespace)
+        if self._select_namespace is None:
+            self._select_namespace = namespace
+            self.select_reaction = namespace['select_reaction']
+        else:
+            # Swap the code of the existing function, so that callers holding it (mainloop, step) see the new order.
+            self._select_namespace.update(namespace)
+            self.select_reaction.__code__ = namespace['select_reaction'].__code__
+
+    def select_reaction(self):
+        """
+        Fast reaction selection using heaps.
+        """
+        mix = self.mix
+        rv = self._next_uniform() * mix.total_activity
+        # locate the channel among the cumulative channel activities; then refine within the channel
         # Note to self: navigation across intervals may need to be changed to accommodate size-dependent alpha
-        rv -= self.mix.unimolecular_binding_activity
-        if rv < self.mix.bond_dissociation_activity:
-            # channel is a bond dissociation
-            select = 'bd'
-            for bt in self.sig.bond_types:
-                if rv < self.mix.activity_bond_dissociation[bt]:
-                    # refine search to molecular level
-                    m = self.mix.complexes[self.heap['bt-'][bt].draw_node(rv)]
-                    # it's molecule of species m; now we need to uniformly choose the instance of bt in m
-                    # bt is (agent_type_1.site_1), (agent_type_2.site_2)
-                    # choose a bond of this type
-                    r = self.rng.integers(low=0, high=m.bond_type[bt])
-                    x, y = m.bond_list[bt][r]
-                    self.current_reaction =  select, (m, None), x, y
-                    return
-                else:
-                    rv -= self.mix.activity_bond_dissociation[bt]
-
-        rv -= self.mix.bond_dissociation_activity
-        if rv < self.mix.bimolecular_binding_activity:
-            # channel is a bimolecular binding
-            select = 'bb'
-            for bt in self.sig.bond_types:
-                if rv < self.mix.activity_bimolecular_binding[bt]:
-                    s1, s2 = bt
-                    # choose at random (uniformly) an s1, i.e. an agent and free site of required type
-                    r1 = self.rng.integers(low=0, high=self.mix.total_free_sites[s1])
-                    m1 = self.mix.complexes[self.heap['st'][s1].draw_node(r1)]
-                    r2 = self.rng.integers(low=0, high=self.mix.total_free_sites[s2] - m1.free_site[s2])
-                    # temporarily modify the specific heap
-                    self.heap['st'][s2].modify(m1.free_site[s2] * (m1.count - 1), self.mix.index[m1])
-                    # draw the molecule
-                    m2 = self.mix.complexes[self.heap['st'][s2].draw_node(r2)]
-                    # undo the mod
-                    self.heap['st'][s2].modify(m1.free_site[s2] * m1.count, self.mix.index[m1])
-                    r1 = self.rng.integers(low=0, high=m1.free_site[s1])
-                    r2 = self.rng.integers(low=0, high=m2.free_site[s2])
-                    name1, site1 = m1.free_site_list[s1][r1]
-                    name2, site2 = m2.free_site_list[s2][r2]
-                    self.current_reaction =  select, (m1, m2), (name1, site1), (name2, site2)
-                    return
-                else:
-                    rv -= self.mix.activity_bimolecular_binding[bt]
-
-        rv -= self.mix.bimolecular_binding_activity
-        if rv < self.mix.total_inflow:
-            # Inflow of atoms. Since there are only a few types, looping is OK.
-            select = 'inflow'
-            for a in self.mix.activity_inflow:
-                if rv < self.mix.activity_inflow[a]:
-                    self.current_reaction =  select, (a, None), (None, None), (None, None)
-                    return
-                else:
-                    rv -= self.mix.activity_inflow[a]
-
-        rv -= self.mix.total_inflow
-        if rv < self.mix.total_outflow:
-            # Outflow of atoms. Since there are only a few types, looping is OK.
-            select = 'outflow'
-            for a in self.mix.activity_outflow:
-                if rv < self.mix.activity_outflow[a]:
-                    self.current_reaction =  select, (a, None), (None, None), (None, None)
-                    return
-                else:
-                    rv -= self.mix.activity_outflow[a]
+        cum = mix.cum_activity
+        j = bisect.bisect_right(cum, rv)
+        if j:
+            rv -= cum[j - 1]
+        self._select[self._channel_kinds[j]](self._channel_keys[j], rv)
+
+    def _select_ub(self, bt, rv):
+        """
+        The channel is a unimolecular binding event; the internal bond to be formed is of type bt.
+        """
+        mix = self.mix
+        uniform = self._next_uniform
+        # refine search to the molecular level
+        h = self.heap_btp[bt]
+        m = mix.complexes[self._draw(h, rv)]
+        # the event is within molecular species m;
+        # now we uniformly choose the instance of bt in m
+        # bt is (agent_type1.site1), (agent_type2.site2)
+        # NOTE: I don't think we need to randomize which site we choose first.
+        s1, s2 = bt
+        r1 = int(uniform() * m.free_site[s1])
+        # this is our choice of site1 = (name1, site1); it belongs to agent name1 in molecule m
+        port1 = m.free_site_list[s1][r1]
+        if s1 == s2:
+            # draw among the other free sites: skip over the position r1 of (name1, site1)
+            # rather than building the reduced list
+            r2 = int(uniform() * (m.free_site[s2] - 1))
+            if r2 >= r1:
+                r2 += 1
+            port2 = m.free_site_list[s2][r2]
+        else:
+            # exclude possibility of self-binding
+            # (free_site_list_idx[s2] maps each entry of free_site_list[s2] to its position)
+            self_port = (port1[0], self.sig.site_suffix[s2])
+            if self_port in m.free_site_list_idx[s2]:
+                j = m.free_site_list_idx[s2][self_port]
+                r2 = int(uniform() * (m.free_site[s2] - 1))
+                if r2 >= j:
+                    r2 += 1
+                port2 = m.free_site_list[s2][r2]
+            else:
+                r2 = int(uniform() * m.free_site[s2])
+                port2 = m.free_site_list[s2][r2]
+        reaction = self._reaction
+        reaction[0] = UB
+        molecules = reaction[1]
+        molecules[0] = m
+        molecules[1] = None
+        reaction[2] = port1
+        reaction[3] = port2
+        self.current_reaction = reaction
+
+    def _select_bd(self, bt, rv):
+        """
+        The channel is a dissociation of a bond of type bt.
+        """
+        mix = self.mix
+        # refine search to molecular level
+        h = self.heap_btm[bt]
+        m = mix.complexes[self._draw(h, rv)]
+        # it's molecule of species m; now we need to uniformly choose the instance of bt in m
+        # bt is (agent_type_1.site_1), (agent_type_2.site_2)
+        # choose a bond of this type
+        # (bond_list[bt] is a list on purpose: kareact appends, extends and swap-removes bonds in O(1),
+        # which an immutable tuple would turn into a copy per bond event)
+        r = int(self._next_uniform() * m.bond_type[bt])
+        reaction = self._reaction
+        reaction[0] = BD
+        molecules = reaction[1]
+        molecules[0] = m
+        molecules[1] = None
+        reaction[2], reaction[3] = m.bond_list[bt][r]
+        self.current_reaction = reaction
+
+    def _select_bb(self, bt, rv):
+        """
+        The channel is a bimolecular binding forming a bond of type bt.
+        """
+        mix = self.mix
+        uniform = self._next_uniform
+        heap_st = self.heap_st
+        s1, s2 = bt
+        # choose at random (uniformly) an s1, i.e. an agent and free site of required type
+        r1 = int(uniform() * mix.total_free_sites[s1])
+        h = heap_st[s1]
+        # (rv and weight go to the kernels as floats, the types kajit.warm_up() compiles for)
+        m1 = mix.complexes[self._draw(h, float(r1))]
+        r2 = int(uniform() * (mix.total_free_sites[s2] - m1.free_site[s2]))
+        # draw the molecule, discounting the s2 sites of the m1 instance already chosen
+        # (the heap itself is not modified)
+        h = heap_st[s2]
+        m2 = mix.complexes[self._draw_excluding(h, float(r2), mix.index[m1], float(m1.free_site[s2]))]
+        r1 = int(uniform() * m1.free_site[s1])
+        r2 = int(uniform() * m2.free_site[s2])
+        reaction = self._reaction
+        reaction[0] = BB
+        molecules = reaction[1]
+        molecules[0] = m1
+        molecules[1] = m2
+        reaction[2] = m1.free_site_list[s1][r1]
+        reaction[3] = m2.free_site_list[s2][r2]
+        self.current_reaction = reaction
+
+    def _select_inflow(self, a, rv):
+        """
+        Inflow of an atom of type a.
+        """
+        reaction = self._reaction
+        reaction[0] = INFLOW
+        molecules = reaction[1]
+        molecules[0] = a
+        molecules[1] = None
+        reaction[2] = reaction[3] = (None, None)
+        self.current_reaction = reaction
+
+    def _select_outflow(self, a, rv):
+        """
+        Outflow of an atom of type a.
+        """
+        reaction = self._reaction
+        reaction[0] = OUTFLOW
+        molecules = reaction[1]
+        molecules[0] = a
+        molecules[1] = None
+        reaction[2] = reaction[3] = (None, None)
+        self.current_reaction = reaction
 
     def report(self, pp_width=40):
         form = '1.5E'
@@ -249,14 +469,16 @@ class CTMC:
         info += f'{"simulator status at time t=":>{pp_width}} {self.time}\n'
         info += '\n'
         info += f'{"total system activity":>{pp_width}}: {self.mix.total_activity:{form}}\n'
-        n_heaps = len(self.heap["bt+"]) + len(self.heap["bt-"]) + len(self.heap["st"])
+        n_heaps = sum(len(heaps) for heaps in (self.heap_btp, self.heap_btm, self.heap_st))
         if n_heaps > 0:
-            info += f'{"heaps":>{pp_width}}: {n_heaps} x ['
-            a = next(iter(self.heap))
-            b = next(iter(self.heap[a]))
-            n_nodes = self.heap[a][b].n_internal_nodes + self.heap[a][b].n_leaves
-            info += f"height: {self.heap[a][b].height} nodes: {n_nodes} "
-            info += f"occ: {self.heap[a][b].n_entries / self.heap[a][b].n_leaves:.2f}]\n\n"
+            h = next(iter(self.heap_btp.values()))
+            if isinstance(h, kaheap.Heap):
+                info += f'{"heaps":>{pp_width}}: {n_heaps} x ['
+                n_nodes = h.n_internal_nodes + h.n_leaves
+                info += f"height: {h.height} nodes: {n_nodes} "
+                info += f"occ: {h.n_entries / h.n_leaves:.2f}]\n\n"
+            else:
+                info += f'{"composition-rejection indices":>{pp_width}}: {n_heaps} x [entries: {h.n_entries}]\n\n'
 
             # for t in ['bt+', 'bt-', 'st']:
             #     for k in self.heap[t]:
@@ -21,6 +21,9 @@ class System:
         """
         self.start_utc = datetime.now(timezone.utc)
         self.start_eastern = self.start_utc.astimezone(tz=ZoneInfo("America/New_York"))
+        # report() runs at every observation; the start times are formatted once
+        self.start_stamps = (self.start_utc.strftime("%Y-%m-%d %H:%M:%S"),
+                             self.start_eastern.strftime("%Y-%m-%d %H:%M:%S"))
         self.uuid = str(uuid.uuid1()).split('-')[0]
 
         self.cmdline = None
@@ -45,6 +48,7 @@ class System:
         self.sim_limit_type = 'time'  # {time, event}
         self.sim_limit = 0.
         self.rng_seed = None
+        self.restore_rg_state = True  # continue the generator state saved in a snapshot (if any)
 
         self.report_file = None
         self.parameter_file = None
@@ -81,8 +85,8 @@ class System:
 
             sim_info = str(self.sim)
 
-            sys_info = f'\n\n{"initialized (UTC)":>30}: {self.start_utc.strftime("%Y-%m-%d %H:%M:%S")}\n'
-            sys_info += f'{"initialized (Boston)":>30}: {self.start_eastern.strftime("%Y-%m-%d %H:%M:%S")}\n'
+            sys_info = f'\n\n{"initialized (UTC)":>30}: {self.start_stamps[0]}\n'
+            sys_info += f'{"initialized (Boston)":>30}: {self.start_stamps[1]}\n'
             sys_info += f'{"uuid":>30}: {self.uuid}\n\n'
             sys_info += f"\n{'COMMAND LINE '.ljust(70, '-')}\n\n"
             sys_info += f'{self.cmdline}\n'
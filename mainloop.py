@@ -4,10 +4,15 @@
 
 import kainit
 import datetime
+import functools
+import time
 
+
+@functools.cache
 def in_notebook():
     """
     Determine whether we are in a notebook environment
+    (This does not change during a session, so the probe runs once.)
     """
     try:
         from IPython import get_ipython
@@ -48,8 +53,9 @@ def loop(system=None):
     system.monitor.observe()
     system.monitor.snapshot(flag='first')
 
-    local_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    local_time = datetime.datetime.now().isoformat(sep=' ', timespec='seconds')
     print(f'\nSimulation <{system.uuid}> started at {local_time}')
+    start_ns = time.monotonic_ns()
 
     # ====================================================================================================
     # The core loop is slightly different for time-based vs event-based observations.
@@ -57,41 +63,49 @@ def loop(system=None):
     # event-based case, a reaction event is carried out in addition to the observation.
     # A slight amount of code duplication makes things more readable...
 
+    # bind the per-event calls once
+    advance = simulator.advance_time
+    select = simulator.select_reaction
+    execute = simulator.execute_reaction
+    fire = monitor.fire
+    sim_limit = system.sim_limit
+
     if system.sim_limit_type == 'time':
-        while simulator.time < system.sim_limit:
-            simulator.advance_time()
-            skip = False
+        # the next observation or snapshot; this only changes when the monitor fires
+        next_trigger = monitor.next_trigger
+        # stopping conditions are thresholds on observed values, so they are checked only after an observation
+        alarm = system.alarm.trigger if system.alarm.alarm else None
+        # The reactions between observations run in one call, so that the loop below only
+        # deals with observations, snapshots and stopping conditions.
+        run = simulator.run_until
+        while simulator.time < sim_limit:
+            # the run of events does not go past the next observation or snapshot
+            run(min(next_trigger, sim_limit))
             # future: add time-specific interventions here...
-            if simulator.time >= monitor.observation_time:
-                simulator.time = monitor.observation_time
-                monitor.observe()
-                # check for stopping conditions
-                if system.alarm.trigger():
-                    # a stopping condition was triggered
-                    break
-                # interim report
-                system.report()
+            if simulator.time >= next_trigger:
                 # an observation (or snapshot or intervention) at a specified time is a "null reaction"
-                skip = True
-            if simulator.time >= monitor.snap_time:
-                simulator.time = monitor.snap_time
-                monitor.snapshot()
-                skip = True
-            # if we had an observation, skip the reaction
-            if not skip:
-                simulator.event += 1
-                simulator.select_reaction()
-                simulator.execute_reaction()
+                simulator.time = next_trigger
+                if fire(next_trigger):
+                    # check for stopping conditions
+                    if alarm and alarm():
+                        # a stopping condition was triggered
+                        break
+                    # interim report
+                    system.report()
+                next_trigger = monitor.next_trigger
     else:
-        while simulator.event < system.sim_limit:
-            simulator.advance_time()
-            if simulator.event == monitor.observation_time:
-                monitor.observe()
-            if simulator.event == monitor.snap_time:
-                monitor.snapshot()
+        while simulator.event < sim_limit:
+            advance()
+            if simulator.event == monitor.next_trigger:
+                fire(simulator.event)
             simulator.event += 1
-            simulator.select_reaction()
-            simulator.execute_reaction()
+            select()
+            execute()
+            # run the events up to the next observation or snapshot in one go
+            # (observation times and the limit are read in as floats)
+            n = int(min(monitor.next_trigger, sim_limit)) - simulator.event
+            if n > 0:
+                simulator.step(n)
 
     # ====================================================================================================
 
@@ -100,8 +114,9 @@ def loop(system=None):
     system.report()
     system.resources_report()
 
-    local_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f'Simulation <{system.uuid}> terminated at {local_time}\n')
+    elapsed = (time.monotonic_ns() - start_ns) * 1.e-9
+    local_time = datetime.datetime.now().isoformat(sep=' ', timespec='seconds')
+    print(f'Simulation <{system.uuid}> terminated at {local_time} ({elapsed:.3f} s)\n')
 
 
 def SiteSim_loop(parameter_file='TestData/parameters_AP.txt'):
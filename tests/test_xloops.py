@@ -0,0 +1,31 @@
+# Walter Fontana, 2023
+"""
+Ensemble runs: independent trajectories must not come out identical.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# the simulator proper (parser, snapshots, matcher) is needed to run trajectories
+for module in ('kamol', 'kasnap', 'kamatch'):
+    pytest.importorskip(module)
+
+import xloops
+
+
+def test_ensemble_trajectories_differ(tmp_path, monkeypatch):
+    monkeypatch.chdir(ROOT)
+    # the parameter file pins a seed; the trajectories must nonetheless get their own
+    monkeypatch.setattr(sys, 'argv', ['xloops.py', '-p', 'TestData/parameters_AP.txt',
+                                      '-X', 'ensemble', 'n=2', '-X', 'dir', str(tmp_path)])
+    xloops.ensemble_loop()
+
+    outputs = []
+    for k in range(2):
+        with open(tmp_path / f'traj{k}' / f'output_traj{k}.csv') as fp:
+            outputs.append(fp.read())
+    assert outputs[0] != outputs[1]
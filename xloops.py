@@ -5,38 +5,130 @@
 import mainloop as main
 import kainit
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 import sys
+import numpy as np
+
+
+def parameter_setter(owner, attribute, label=None):
+    """
+    Returns a handler for modify_parameters() that sets 'attribute' of the object owner(system).
+    Handlers return a description of the update.
+    """
+    def set_parameter(system, value):
+        obj = owner(system)
+        setattr(obj, attribute, value)
+        return f'"{label or attribute}" = {getattr(obj, attribute)}'
+    return set_parameter
+
+
+def set_temperature(system, value):
+    system.parameters.Temperature = float(value) + 273.15  # in K
+    return f'"Temperature" = {value} ºC ({system.parameters.Temperature} K)'
+
+
+def set_trajectory_seed(system, value):
+    """
+    value = (base, fallback, k): trajectory k of an ensemble gets the seed base + k. Without an explicit
+    base, the seed of the parameter file is the base, and without that, the fallback (fresh entropy).
+    A generator state saved in an initial snapshot would override the seed, so it is not restored.
+    """
+    base, fallback, k = value
+    if base is None:
+        base = system.parameters.rng_seed
+    if base is None:
+        base = fallback
+    system.parameters.rng_seed = base + k
+    system.restore_rg_state = False
+    return f'"seed" = {system.parameters.rng_seed}'
+
+
+def set_initial_agent_counts(system, value):
+    for agent_type, count in value.items():
+        system.signature.init_agents[agent_type] = count
+    return ', '.join(f'initial count of {agent_type} = {count}' for agent_type, count in value.items())
+
+
+# modify_parameters(): the handler for each modifiable parameter
+parameter_handlers = {
+    # file names
+    'report_fn': parameter_setter(lambda system: system, 'report_file'),
+    'output_fn': parameter_setter(lambda system: system.monitor, 'obs_file_name', 'csv_datafile'),
+    'snap_root': parameter_setter(lambda system: system.monitor, 'snap_root_name', 'snap_root'),
+    # physical parameters
+    'RescaleTemperature': parameter_setter(lambda system: system.parameters, 'RescaleTemperature'),
+    'Temperature': set_temperature,  # in C
+    'ResizeVolume': parameter_setter(lambda system: system.parameters, 'ResizeVolume'),
+    'referenceRingClosureFactor': parameter_setter(lambda system: system.parameters, 'referenceRingClosureFactor'),
+    'trajectory_seed': set_trajectory_seed,
+    'initial_agent_counts': set_initial_agent_counts,
+}
+
 
 def modify_parameters(system, **kwargs):
+    updates = []
     for key, value in kwargs.items():
-        match key:
-            # file names
-            case 'report_fn':
-                system.report_file = value
-                print(f'"report_file" updated to {system.report_file}')
-            case 'output_fn':
-                system.monitor.obs_file_name = value
-                print(f'"csv_datafile" updated to {system.monitor.obs_file_name}')
-            case 'snap_root':
-                system.monitor.snap_root_name = value
-                print(f'"snap_root" updated to {system.monitor.snap_root_name}')
-            # physical parameters
-            case 'RescaleTemperature':
-                system.parameters.RescaleTemperature = value
-                print(f'"RescaleTemperature" updated to {system.parameters.RescaleTemperature}')
-            case 'Temperature':  # in C
-                system.parameters.Temperature = float(value) + 273.15  # in K
-                print(f'"Temperature" updated to {value} ºC ({system.parameters.Temperature} K)')
-            case 'ResizeVolume':
-                system.parameters.ResizeVolume = value
-                print(f'"ResizeVolume" updated to {system.parameters.ResizeVolume}')
-            case 'referenceRingClosureFactor':
-                system.parameters.referenceRingClosureFactor = value
-                print(f'"referenceRingClosureFactor" updated to {system.parameters.referenceRingClosureFactor}')
-            case 'initial_agent_counts':
-                for agent_type, count in value.items():
-                    system.signature.init_agents[agent_type] = count
-                    print(f'Initial agent count for {agent_type} updated to {count}')
+        # keys without a handler are ignored
+        handler = parameter_handlers.get(key)
+        if handler:
+            updates.append(handler(system, value))
+    # one line for all updates
+    updates = [u for u in updates if u]
+    if updates:
+        print('updated: ' + '; '.join(updates))
+
+
+def make_directories(dir_names):
+    """
+    Creates the directories in dir_names. A name that exists (or occurs earlier in the list) gets an
+    identifier '--i' added. The names are settled first and the directories made after, so that no
+    simulation starts before all its siblings have a place. Returns the names of the directories created.
+    """
+    taken = set()
+    unique = []
+    for dir_name in dir_names:
+        name = dir_name
+        i = 0
+        while name in taken or Path(name).exists():
+            i += 1
+            if i > 100:
+                sys.exit(f'Refuse to add identifier to {dir_name}. Exiting.')
+            name = f'{dir_name}--{i}'
+        if i:
+            print(f'directory {dir_name} already exists. Using {name}.')
+        taken.add(name)
+        unique.append(name)
+    for name in unique:
+        Path(name).mkdir(parents=True)
+    return unique
+
+
+def run_one(job):
+    """
+    Initializes and runs the simulation for job = (settings, mod_args), then clears it. The job is
+    self-contained: the system is built afresh from the command line settings (see kainit.commandline_settings())
+    and mod_args, whatever global system the process inherited.
+    """
+    settings, mod_args = job
+    system = kainit.initialize(settings=settings, modifier_fun=modify_parameters, **mod_args)
+    main.loop(system=system)
+    # clear objects
+    kainit.clear_SiteSim()
+
+
+def run_jobs(jobs, n_jobs=1):
+    """
+    Runs the independent simulations in 'jobs', n_jobs at a time in separate processes.
+    (Each process has its own global system object; since the jobs carry all their settings, the
+    outcome does not depend on n_jobs or on how the platform starts processes.)
+    """
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as ex:
+            list(ex.map(run_one, jobs))
+    else:
+        for job in jobs:
+            run_one(job)
+
 
 # ========================================================================================================
 # Specialized loops
@@ -56,10 +148,11 @@ def TC_loop():
     T_loop_end = 1
     C_loop_start = 0
     C_loop_end = 1
+    n_jobs = 1  # simulations run in parallel
 
     system = kainit.commandline(invocation=None)
-    # save the parameter file name from the command line for repeated initialization below
-    parameter_file = system.parameter_file
+    # save the command line settings for repeated initialization below
+    settings = kainit.commandline_settings()
 
     # process "extra" arguments
     if system.xargs:
@@ -92,82 +185,103 @@ def TC_loop():
                         C_loop_end = int(val)
                     else:
                         sys.exit(f"X argument: Concentration parameter {var} not recognized.")
+            elif key == 'jobs':
+                n_jobs = int(value[0])
             elif key == 'dir':
                 dir_root = value[0].strip()
                 if dir_root[-1] != '/':
                     dir_root += '/'
 
+    # the sweep plan: a run for each combination of temperature and concentration
+    temps = T_start + np.arange(T_loop_start, T_loop_end) * T_delta
+    concentrations = C_start + np.arange(C_loop_start, C_loop_end) * C_delta
+    TT, CC = np.meshgrid(temps, concentrations, indexing='ij')  # temperature-major, as the runs are ordered
+    plan = []
+    for temp, concentration in zip(TT.ravel().tolist(), CC.ravel().tolist()):
+        if agent_type:
+            run_name = f'T{temp}_{agent_type}{concentration}'
+        else:
+            run_name = f'T{temp}'
+        plan.append((temp, concentration, run_name))
+
     # preview
     print("These directories will be eventually created:")
-    for t in range(T_loop_start, T_loop_end):
-        temp = T_start + t * T_delta
-        for c in range(C_loop_start, C_loop_end):
-            concentration = C_start + c * C_delta
-            if agent_type:
-                run_name = f'T{temp}_{agent_type}{concentration}'
-            else:
-                run_name = f'T{temp}'
-            dir_name = dir_root + run_name
-            print(dir_name)
+    for temp, concentration, run_name in plan:
+        print(dir_root + run_name)
     ans = input("Continue? [N/y] ")
     if ans != 'y':
         sys.exit("Exiting.")
 
     # ====================================================================================================
-    mod_args = {}
-    agent_dict = {}
-    for t in range(T_loop_start, T_loop_end):
-        temp = T_start + t * T_delta
-        for c in range(C_loop_start, C_loop_end):
-            concentration = C_start + c * C_delta
-
-            if agent_type:
-                agent_dict[agent_type] = concentration
-                run_name = f'T{temp}_{agent_type}{concentration}'
-            else:
-                run_name = f'T{temp}'
-
-            mod_args['initial_agent_counts'] = agent_dict
-
-            # make directory
-            dir_name = dir_root + run_name
-            try:
-                Path(dir_name).mkdir(parents=True, exist_ok=False)
-            except FileExistsError:
-                while True:
-                    print(f'directory {dir_name} already exists. Trying to add identifier.')
-                    dir_split = dir_name.split('--')
-                    if len(dir_split) == 1:
-                        dir_name = dir_split[0] + f'--{1}'
+    # The directories are made up front; the simulations then run independently of each other.
+    dir_names = make_directories([dir_root + run_name for temp, concentration, run_name in plan])
+    jobs = []
+    for (temp, concentration, run_name), dir_name in zip(plan, dir_names):
+        # each cell gets its own dictionaries, as the jobs hold on to them
+        mod_args = {'initial_agent_counts': {agent_type: concentration} if agent_type else {},
+                    'report_fn': dir_name + f'/report_{run_name}.txt',
+                    'output_fn': dir_name + f'/output_{run_name}.csv',
+                    'snap_root': dir_name + f'/snap_{run_name}_',
+                    'Temperature': temp}
+        # mod_args['ResizeVolume'] = 0.1
+        # mod_args['RescaleTemperature'] = 1.
+        # mod_args['referenceRingClosureFactor'] = 1.e+5
+
+        jobs.append((settings, mod_args))
+
+    run_jobs(jobs, n_jobs)
+
+
+def ensemble_loop():
+    """
+    Simulation loop over independent trajectories of the same system, differing only in their seed
+    """
+    # defaults
+    dir_root = './'
+    n_traj = 1
+    n_jobs = 1  # simulations run in parallel
+
+    system = kainit.commandline(invocation=None)
+    # save the command line settings for repeated initialization below
+    settings = kainit.commandline_settings()
+    # the command line seed is the default base of the trajectory seeds
+    seed = system.rng_seed
+
+    # process "extra" arguments
+    if system.xargs:
+        for key, value in system.xargs.arg_dict.items():
+            if key == 'ensemble':
+                for item in value:
+                    var, val = item.split('=')
+                    if var == 'n':
+                        n_traj = int(val)
+                    elif var == 'seed':  # trajectory k uses seed + k
+                        seed = int(val)
                     else:
-                        n = dir_split[-1]
-                        if n.isdigit():
-                            i = int(n)
-                            if i > 100:
-                                sys.exit(f'Refuse to add identifier to {dir_name}. Exiting.')
-                        else:
-                            i = 0
-                        i = str(i + 1)
-                        dir_name = ''.join(dir_split[:-1]) + f'--{i}'
-                    try:
-                        Path(dir_name).mkdir(parents=True, exist_ok=False)
-                        break
-                    except FileExistsError:
-                        continue
-
-            mod_args['report_fn'] = dir_name + f'/report_{run_name}.txt'
-            mod_args['output_fn'] = dir_name + f'/output_{run_name}.csv'
-            mod_args['snap_root'] = dir_name + f'/snap_{run_name}_'
-            mod_args['Temperature'] = temp
-            # mod_args['ResizeVolume'] = 0.1
-            # mod_args['RescaleTemperature'] = 1.
-            # mod_args['referenceRingClosureFactor'] = 1.e+5
-
-            system = kainit.initialize(parameter_file=parameter_file, modifier_fun=modify_parameters, **mod_args)
-            main.loop(system=system)
-
-            # clear objects
-            kainit.clear_SiteSim()
+                        sys.exit(f"X argument: Ensemble parameter {var} not recognized.")
+            elif key == 'jobs':
+                n_jobs = int(value[0])
+            elif key == 'dir':
+                dir_root = value[0].strip()
+                if dir_root[-1] != '/':
+                    dir_root += '/'
+
+    # ====================================================================================================
+    # Trajectory k runs with seed + k. The base is, in order: the ensemble seed, the command line seed,
+    # the seed of the parameter file, or else fresh entropy drawn once for the whole ensemble.
+    # (The seed of each trajectory is in its report.)
+    entropy = np.random.SeedSequence().entropy
+    run_names = [f'traj{k}' for k in range(n_traj)]
+    dir_names = make_directories([dir_root + run_name for run_name in run_names])
+    jobs = []
+    for k, (run_name, dir_name) in enumerate(zip(run_names, dir_names)):
+        mod_args = {'report_fn': dir_name + f'/report_{run_name}.txt',
+                    'output_fn': dir_name + f'/output_{run_name}.csv',
+                    'snap_root': dir_name + f'/snap_{run_name}_',
+                    'trajectory_seed': (seed, entropy, k)}
+        jobs.append((settings, mod_args))
+
+    run_jobs(jobs, n_jobs)
 
 
 if __name__ == '__main__':